@@ -1,41 +1,214 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Quiz, Question, Answer, QuizSession, Participant, UserAnswer
+from django.core.paginator import Paginator
+from django.db import connections
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .metrics import metrics
+from .models import Quiz, Question, Answer, QuizSession, Participant, UserAnswer, SessionResult, SessionArchive, UserStats
+
+# С какого числа строк список без фильтров показывает оценку количества вместо COUNT(*)
+ADMIN_ESTIMATE_THRESHOLD = getattr(settings, 'QUIZ_ADMIN_ESTIMATE_THRESHOLD', 100_000)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор больших списков: без фильтров количество берется из статистики PostgreSQL, а не COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ADMIN_ESTIMATE_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+def related_filter(field_name, title):
+    """Фильтр по связанному объекту без выпадающего списка всех объектов: выбор приходит ссылкой из родителя
+
+    В боковой панели виден только выбранный объект; ссылки на отфильтрованные списки дает drill_down.
+    """
+
+    class RelatedFilter(admin.SimpleListFilter):
+        parameter_name = f'{field_name}__id__exact'
+
+        def lookups(self, request, model_admin):
+            value = self.value()
+            if not value or not value.isdigit():
+                return []
+            related = model_admin.model._meta.get_field(field_name).related_model
+            obj = related._default_manager.filter(pk=value).first()
+            return [(value, str(obj) if obj is not None else value)]
+
+        def queryset(self, request, queryset):
+            value = self.value()
+            if value and value.isdigit():
+                return queryset.filter(**{f'{field_name}_id': value})
+            return queryset
+
+    RelatedFilter.title = title
+    return RelatedFilter
+
+
+def drill_down(model, field_name, obj, label):
+    """Ссылка на список model, отфильтрованный по obj через related_filter"""
+    url = reverse(f'admin:quiz_{model._meta.model_name}_changelist')
+    return format_html('<a href="{}?{}__id__exact={}">{}</a>', url, field_name, obj.pk, label)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список большой таблицы: оценка количества, без второго COUNT для «показать все», сортировка по ключу"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class AnswerInline(admin.TabularInline):
+    model = Answer
+    fields = ['answer_text', 'is_correct']
+    extra = 0
+
+
+class QuestionInline(admin.TabularInline):
+    model = Question
+    fields = ['order', 'question_text', 'question_type', 'video_url']
+    ordering = ['order']
+    extra = 0
+    show_change_link = True
 
 
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
-    list_display = ['title', 'creator', 'created_at', 'is_active', 'code']
-    list_filter = ['is_active', 'created_at']
-    search_fields = ['title', 'description']
+    list_display = ['title', 'creator', 'created_at', 'is_active', 'code', 'sessions_link']
+    list_select_related = ['creator']
+    list_filter = ['is_active', 'created_at', 'scoring_mode']
+    search_fields = ['title', 'description', 'code']
     readonly_fields = ['code', 'created_at']
+    raw_id_fields = ['creator']
+    # Вопросы викторины редактируются на ее странице пачкой
+    inlines = [QuestionInline]
+
+    @admin.display(description='Сессии')
+    def sessions_link(self, obj):
+        return drill_down(QuizSession, 'quiz', obj, 'Сессии')
 
 
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
     list_display = ['question_text', 'quiz', 'question_type', 'order']
-    list_filter = ['question_type', 'quiz']
-    search_fields = ['question_text']
+    list_select_related = ['quiz']
+    # Тип меняется прямо в списке сразу у многих вопросов; порядок правится на странице викторины
+    list_editable = ['question_type']
+    list_filter = ['question_type', related_filter('quiz', 'Викторина')]
+    search_fields = ['question_text', 'quiz__title']
+    autocomplete_fields = ['quiz']
+    ordering = ['quiz', 'order']
+    inlines = [AnswerInline]
 
 
 @admin.register(Answer)
-class AnswerAdmin(admin.ModelAdmin):
+class AnswerAdmin(LargeTableAdmin):
     list_display = ['answer_text', 'question', 'is_correct']
-    list_filter = ['is_correct', 'question__quiz']
+    list_select_related = ['question__quiz']
+    list_editable = ['is_correct']
+    list_filter = ['is_correct', related_filter('question', 'Вопрос')]
+    search_fields = ['answer_text']
+    raw_id_fields = ['question']
+    ordering = ['-id']
 
 
 @admin.register(QuizSession)
-class QuizSessionAdmin(admin.ModelAdmin):
-    list_display = ['quiz', 'session_code', 'is_active', 'started_at']
-    list_filter = ['is_active', 'started_at']
+class QuizSessionAdmin(LargeTableAdmin):
+    list_display = ['session_code', 'quiz', 'is_active', 'started_at', 'ended_at', 'participants_link']
+    list_select_related = ['quiz']
+    list_filter = ['is_active', related_filter('quiz', 'Викторина')]
+    search_fields = ['session_code']
+    raw_id_fields = ['quiz', 'current_question']
+    readonly_fields = ['metrics_summary']
+    ordering = ['-id']
+
+    @admin.display(description='Участники')
+    def participants_link(self, obj):
+        return drill_down(Participant, 'session', obj, 'Участники')
+
+    @admin.display(description='Метрики (этот процесс)')
+    def metrics_summary(self, obj):
+        summary = metrics.session_summary(obj.session_code)
+        if not summary:
+            return '—'
+        queries = f"{summary['queries'] / summary['sampled']:.1f}" if summary['sampled'] else '—'
+        return (
+            f"Сообщений: {summary['messages']}, "
+            f"среднее время: {summary['seconds'] / summary['messages'] * 1000:.1f} мс, "
+            f"максимум: {summary['max'] * 1000:.1f} мс, "
+            f"запросов к БД на сообщение: {queries}"
+        )
 
 
 @admin.register(Participant)
-class ParticipantAdmin(admin.ModelAdmin):
-    list_display = ['nickname', 'session', 'score', 'joined_at']
-    list_filter = ['session', 'joined_at']
+class ParticipantAdmin(LargeTableAdmin):
+    list_display = ['nickname', 'session', 'user', 'score', 'response_ms', 'joined_at', 'answers_link']
+    list_select_related = ['session__quiz', 'user']
+    # Участники смотрятся по сессии (ссылка из списка сессий), а не перебором всех сессий в фильтре
+    list_filter = [related_filter('session', 'Сессия'), related_filter('user', 'Пользователь')]
+    search_fields = ['nickname', '=session__session_code']
+    raw_id_fields = ['session', 'user']
+    ordering = ['-id']
+
+    @admin.display(description='Ответы')
+    def answers_link(self, obj):
+        return drill_down(UserAnswer, 'participant', obj, 'Ответы')
 
 
 @admin.register(UserAnswer)
-class UserAnswerAdmin(admin.ModelAdmin):
-    list_display = ['participant', 'question', 'answer', 'is_correct', 'answered_at']
-    list_filter = ['is_correct', 'answered_at']
+class UserAnswerAdmin(LargeTableAdmin):
+    # Столбцы берут поля из одного JOIN, а не через __str__ со связями до викторины
+    list_display = ['id', 'participant_nickname', 'question_label', 'answer_text', 'is_correct', 'points', 'response_ms', 'answered_at']
+    list_select_related = ['participant', 'question', 'answer']
+    list_filter = ['is_correct', related_filter('participant', 'Участник'), related_filter('question', 'Вопрос')]
+    raw_id_fields = ['participant', 'question', 'answer']
+    ordering = ['-id']
+
+    @admin.display(description='Участник', ordering='participant__nickname')
+    def participant_nickname(self, obj):
+        return obj.participant.nickname
+
+    @admin.display(description='Вопрос')
+    def question_label(self, obj):
+        return f'#{obj.question.order} {obj.question.question_text[:60]}'
+
+    @admin.display(description='Ответ')
+    def answer_text(self, obj):
+        return obj.answer.answer_text
+
+
+@admin.register(SessionResult)
+class SessionResultAdmin(admin.ModelAdmin):
+    list_display = ['session', 'participant_count', 'question_count', 'computed_at']
+    list_select_related = ['session__quiz']
+    readonly_fields = ['session', 'participant_count', 'question_count', 'ranking', 'questions', 'computed_at']
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total_score', 'total_quizzes_participated', 'total_quizzes_created', 'updated_at']
+    list_select_related = ['user']
+    search_fields = ['user__username']
+    ordering = ['-total_score', 'user']
+    readonly_fields = ['user', 'total_score', 'total_quizzes_participated', 'total_quizzes_created', 'updated_at']
+
+
+@admin.register(SessionArchive)
+class SessionArchiveAdmin(admin.ModelAdmin):
+    list_display = ['session', 'participant_count', 'answer_count', 'archived_at']
+    list_select_related = ['session__quiz']
+    # Сжатые данные не показываются: их читает quiz.archive.iter_archive
+    exclude = ['data']
+    readonly_fields = ['session', 'participant_count', 'answer_count', 'user_scores', 'archived_at']
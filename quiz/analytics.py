@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .broadcast import host_group
+from .protocol import encode
+
+ANALYTICS_TICK = getattr(settings, 'QUIZ_ANALYTICS_TICK', 1.0)
+ANALYTICS_TOP = getattr(settings, 'QUIZ_ANALYTICS_TOP', 10)
+
+# Метка процесса: свои изменения, вернувшиеся через группу ведущих, повторно не учитываются
+ORIGIN = uuid.uuid4().hex
+
+
+async def send_answer(session_code, participant_id, position, question_id, answer_id):
+    """Учет ответа, принятого по HTTP без состояния комнаты в процессе, воркерами с панелью ведущего
+
+    У пакета своя метка участника, а номер пакета — место вопроса в порядке сессии: участник отвечает
+    на вопрос один раз и по порядку, поэтому повтор пакета не учитывается дважды.
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    await layer.group_send(host_group(session_code), {
+        'type': 'analytics',
+        'origin': f'participant-{participant_id}',
+        'batch': position + 1,
+        'delta': [[question_id, answer_id, 1]],
+    })
+
+
+class RoomAnalytics:
+    """Счетчики ответов комнаты в памяти для панели ведущего; изменения рассылаются не чаще раза за тик"""
+
+    def __init__(self, state, tick=ANALYTICS_TICK):
+        self.state = state
+        self.tick = tick
+        # question_id -> {answer_id -> количество ответов}
+        self.histograms = {}
+        # Изменения этого воркера с прошлой рассылки: (question_id, answer_id) -> количество
+        self._delta = {}
+        # origin -> номер последнего учтенного пакета другого воркера
+        self._applied = {}
+        self._batch = 0
+        self._timer = None
+        self._last_sent = None
+        self._tasks = set()
+
+    def _count(self, question_id, answer_id, n):
+        counts = self.histograms.setdefault(question_id, {})
+        counts[answer_id] = counts.get(answer_id, 0) + n
+
+    def seed(self, rows):
+        """Начальные счетчики из БД при загрузке состояния: (question_id, answer_id, количество)"""
+        for question_id, answer_id, n in rows:
+            self._count(question_id, answer_id, n)
+
+    def answer_added(self, question_id, answer_id):
+        """Учет принятого ответа; вызывается на каждый ответ и не обращается ни к БД, ни к хранилищу"""
+        self._count(question_id, answer_id, 1)
+        key = (question_id, answer_id)
+        self._delta[key] = self._delta.get(key, 0) + 1
+        self._schedule()
+
+    def apply(self, event):
+        """Учет пакета изменений другого воркера (пакет приходит каждому сокету ведущего, учитывается один раз)"""
+        origin, batch = event['origin'], event['batch']
+        if origin == ORIGIN or batch <= self._applied.get(origin, 0):
+            return
+        self._applied[origin] = batch
+        for question_id, answer_id, n in event['delta']:
+            self._count(question_id, answer_id, n)
+
+    def frame(self):
+        """Кадр панели ведущего: распределение ответов текущего вопроса, сколько ответили и первые места"""
+        question = self.state.current_question
+        counts = self.histograms.get(question['id'], {}) if question else {}
+        answered = sum(counts.values())
+        return encode(
+            'analytics',
+            question_id=question['id'] if question else None,
+            answers=[
+                {'id': answer['id'], 'answer_text': answer['answer_text'], 'count': counts.get(answer['id'], 0)}
+                for answer in question['answers']
+            ] if question else [],
+            answered=answered,
+            not_answered=max(0, len(self.state.participants) - answered),
+            top=self.state.ranking(ANALYTICS_TOP),
+        )
+
+    def _schedule(self):
+        if self._timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = 0 if self._last_sent is None else max(0, self._last_sent + self.tick - loop.time())
+        self._timer = loop.call_later(delay, self._spawn)
+
+    def _spawn(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Рассылка накопленных изменений группе ведущих; сокеты ведущих в ответ отправляют свежий кадр"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._delta:
+            return
+
+        delta = [[question_id, answer_id, n] for (question_id, answer_id), n in self._delta.items()]
+        self._delta = {}
+        self._batch += 1
+        self._last_sent = asyncio.get_running_loop().time()
+        await get_channel_layer().group_send(host_group(self.state.session_code), {
+            'type': 'analytics',
+            'origin': ORIGIN,
+            'batch': self._batch,
+            'delta': delta,
+        })
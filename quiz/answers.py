@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Participant, UserAnswer
+
+logger = logging.getLogger(__name__)
+
+ANSWER_FLUSH_SIZE = getattr(settings, 'QUIZ_ANSWER_FLUSH_SIZE', 200)
+ANSWER_FLUSH_INTERVAL = getattr(settings, 'QUIZ_ANSWER_FLUSH_INTERVAL', 0.5)
+# Запас на задержку сети: ответ, отправленный до дедлайна, еще принимается
+ANSWER_GRACE = getattr(settings, 'QUIZ_ANSWER_GRACE', 0.5)
+# Режим 'speed': от SPEED_POINTS за мгновенный ответ до половины за ответ на дедлайне
+SPEED_POINTS = getattr(settings, 'QUIZ_SPEED_POINTS', 1000)
+# Режим 'streak': STREAK_POINTS, умноженные на длину серии (не больше STREAK_MAX)
+STREAK_POINTS = getattr(settings, 'QUIZ_STREAK_POINTS', 100)
+STREAK_MAX = getattr(settings, 'QUIZ_STREAK_MAX', 5)
+# Сколько секунд завершение сессии ждет записи ответов из буферов других воркеров перед подсчетом итогов
+RESULTS_WAIT = getattr(settings, 'QUIZ_RESULTS_WAIT', 5)
+
+
+class AnswerBuffer:
+    """Очередь принятых ответов, которая записывается в БД пакетами по размеру или по таймеру"""
+
+    def __init__(self, size=ANSWER_FLUSH_SIZE, interval=ANSWER_FLUSH_INTERVAL):
+        self.size = size
+        self.interval = interval
+        # (participant_id, question_id, answer_id, is_correct, points, response_ms, answered_at)
+        self._rows = []
+        self._timer = None
+        # Последняя запись не удалась: следующая попытка идет по таймеру, а не на каждый новый ответ
+        self._retrying = False
+        self._tasks = set()
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, participant_id, question_id, answer_id, is_correct, points, response_ms, answered_at=None):
+        self._rows.append((
+            participant_id, question_id, answer_id, is_correct, points, response_ms, answered_at or timezone.now()
+        ))
+        if len(self._rows) >= self.size and not self._retrying:
+            self._spawn()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._spawn)
+
+    def _spawn(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Запись накопленных ответов; возвращается после записи всего, что было принято до вызова"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                await database_sync_to_async(write_answers)(rows)
+            except Exception:
+                # Пакет возвращается в начало очереди: повторная запись безопасна (ignore_conflicts)
+                logger.exception('Не записан пакет ответов (%d), повтор через %s с', len(rows), self.interval)
+                self._rows[:0] = rows
+                self._retrying = True
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.interval, self._spawn)
+            else:
+                self._retrying = False
+
+
+def unwritten_answers(store, session_id, question_ids):
+    """Сколько ответов сессии принято общим хранилищем (в любом воркере), но еще не записано в БД"""
+    accepted = store.count_answered(session_id, question_ids)
+    written = UserAnswer.objects.filter(participant__session_id=session_id, question_id__in=question_ids).count()
+    return max(0, accepted - written)
+
+
+async def wait_for_answers(store, session_id, question_ids, timeout=RESULTS_WAIT):
+    """Ожидание, пока буферы всех воркеров запишут ответы сессии; False, если за timeout секунд не успели"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while await database_sync_to_async(unwritten_answers)(store, session_id, question_ids):
+        if loop.time() >= deadline:
+            logger.warning('Итоги сессии %s считаются без части ответов: буферы не записаны за %s с',
+                           session_id, timeout)
+            return False
+        await asyncio.sleep(ANSWER_FLUSH_INTERVAL / 5)
+    return True
+
+
+def answer_points(mode, is_correct, elapsed, limit, streak=1):
+    """Очки за ответ по режиму викторины; elapsed — секунды от открытия вопроса до получения ответа"""
+    if not is_correct:
+        return 0
+    if mode == 'speed':
+        ratio = min(elapsed / limit, 1) if limit > 0 else 1
+        return round(SPEED_POINTS * (1 - ratio / 2))
+    if mode == 'streak':
+        return STREAK_POINTS * min(streak, STREAK_MAX)
+    return 1
+
+
+def accept_answer(store, snapshot, session_id, participant_id, question_index, is_correct, received_at,
+                  timing=None, sequence=None):
+    """Учет ответа, полученного в received_at по time.time(), для WebSocket и HTTP
+
+    timing — (question_id, открытие, дедлайн) вопроса по таймеру этого воркера; без него время открытия
+    берется из общего хранилища. None, если участник уже отвечал, вопрос не текущий или не входит в сессию,
+    либо ответ пришел после дедлайна.
+    """
+    question_id = snapshot.questions[question_index]['id']
+    if sequence is not None and question_id not in sequence.position_of:
+        # Вопрос отрезан при запуске сессии (?count=N)
+        return None
+    if timing is None:
+        timing = store.get_timing(session_id)
+    if timing is not None and timing[0] != question_id:
+        # Уже открыт другой вопрос, этот закрыт
+        return None
+    if timing is None and store.get_current(session_id) != question_id:
+        # Без таймера принимается только ответ на текущий вопрос сессии
+        return None
+    _, opened, deadline = timing or (None, None, None)
+    if deadline is not None and received_at > deadline + ANSWER_GRACE:
+        return None
+    if not store.mark_answered(session_id, question_id, participant_id):
+        return None
+    limit = snapshot.time_per_question
+    # Вопрос открыт до появления общего времени открытия: ответ считается данным на дедлайне
+    elapsed = limit if opened is None else min(max(0, received_at - opened), limit)
+    streak = 1
+    if snapshot.scoring_mode == 'streak':
+        # Серия идет по порядку показа в сессии, а не по порядку вопросов в викторине
+        position = sequence.position_of.get(question_id, question_index) if sequence is not None else question_index
+        streak = store.next_streak(session_id, participant_id, position, is_correct)
+    points = answer_points(snapshot.scoring_mode, is_correct, elapsed, limit, streak)
+    response_ms = round(elapsed * 1000)
+    # Неверный ответ прибавляет 0 очков и возвращает текущий счет тем же атомарным вызовом
+    score, time = store.add_score(session_id, participant_id, points, response_ms)
+    return {'points': points, 'response_ms': response_ms, 'score': score, 'time': time}
+
+
+def _answers_total(field):
+    return Coalesce(Subquery(
+        UserAnswer.objects.filter(participant=OuterRef('pk')).order_by().values('participant').annotate(
+            total=Sum(field)
+        ).values('total')[:1]
+    ), 0)
+
+
+def write_answers(rows):
+    """Один INSERT без конфликтующих строк и один UPDATE счетов в короткой транзакции
+
+    Строка: (participant_id, question_id, answer_id, is_correct, points, response_ms, answered_at).
+    """
+    participant_ids = {row[0] for row in rows}
+    with transaction.atomic():
+        UserAnswer.objects.bulk_create([
+            UserAnswer(
+                participant_id=participant_id,
+                question_id=question_id,
+                answer_id=answer_id,
+                is_correct=is_correct,
+                points=points,
+                response_ms=response_ms,
+                answered_at=answered_at
+            )
+            for participant_id, question_id, answer_id, is_correct, points, response_ms, answered_at in rows
+        ], ignore_conflicts=True)
+        # Счет пересчитывается из записанных ответов, а не прибавляется: повтор уже записанного
+        # ответа (пропущенный ignore_conflicts) не дает лишних очков, а параллельные записи не теряются
+        Participant.objects.filter(id__in=participant_ids).update(
+            score=_answers_total('points'),
+            response_ms=_answers_total('response_ms'),
+        )
@@ -0,0 +1,98 @@
+import json
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import QuizSession, Participant, UserAnswer, SessionArchive
+from .results import materialize_results
+
+# Завершенные сессии старше этого срока переносятся в архив командой quiz_archive
+ARCHIVE_AFTER = timedelta(days=getattr(settings, 'QUIZ_ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_CHUNK_SIZE = getattr(settings, 'QUIZ_ARCHIVE_CHUNK_SIZE', 2000)
+
+PARTICIPANT_FIELDS = ('id', 'user_id', 'nickname', 'score', 'response_ms', 'joined_at')
+ANSWER_FIELDS = ('participant_id', 'question_id', 'answer_id', 'is_correct', 'points', 'response_ms', 'answered_at')
+
+
+def archivable_sessions(before=None):
+    """Id завершенных сессий, закончившихся раньше before и еще не перенесенных в архив"""
+    before = before or timezone.now() - ARCHIVE_AFTER
+    # ended_at заполнен миграцией 0009; у сессий, завершенных без него позже, берется время начала
+    return QuizSession.objects.filter(
+        Q(ended_at__lt=before) | Q(ended_at__isnull=True, started_at__lt=before),
+        is_active=False, archive__isnull=True,
+    ).order_by('started_at', 'id').values_list('id', flat=True)
+
+
+def _line(kind, row):
+    row = [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+    return (json.dumps([kind] + row, ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+
+@transaction.atomic
+def archive_session(session_id):
+    """Перенос участников и ответов завершенной сессии в SessionArchive; None, если переносить нечего
+
+    Строки читаются и сжимаются пачками по ARCHIVE_CHUNK_SIZE, итоги сессии (SessionResult) остаются.
+    """
+    session = QuizSession.objects.select_for_update().filter(id=session_id, is_active=False).first()
+    if session is None or SessionArchive.objects.filter(session_id=session_id).exists():
+        return None
+    # Результаты и статистика пользователей считаются по рабочим таблицам, поэтому до переноса
+    materialize_results(session_id)
+
+    compressor = zlib.compressobj(9)
+    data = []
+    participant_count = answer_count = 0
+    user_scores = {}
+    for row in Participant.objects.filter(session_id=session_id).order_by('id').values_list(
+        *PARTICIPANT_FIELDS
+    ).iterator(chunk_size=ARCHIVE_CHUNK_SIZE):
+        data.append(compressor.compress(_line('p', row)))
+        participant_count += 1
+        _, user_id, _, score, _, _ = row
+        if user_id is not None:
+            user_scores[str(user_id)] = user_scores.get(str(user_id), 0) + score
+    for row in UserAnswer.objects.filter(participant__session_id=session_id).order_by('id').values_list(
+        *ANSWER_FIELDS
+    ).iterator(chunk_size=ARCHIVE_CHUNK_SIZE):
+        data.append(compressor.compress(_line('a', row)))
+        answer_count += 1
+    data.append(compressor.flush())
+
+    archive = SessionArchive.objects.create(
+        session_id=session_id,
+        participant_count=participant_count,
+        answer_count=answer_count,
+        user_scores=user_scores,
+        data=b''.join(data),
+    )
+    # Ответы удаляются одним DELETE без выборки строк; участники — после них
+    UserAnswer.objects.filter(participant__session_id=session_id).delete()
+    Participant.objects.filter(session_id=session_id).delete()
+    return archive
+
+
+def iter_archive(archive):
+    """Строки архива по одной: ('participant', {...}) и ('answer', {...}); распаковка идет по частям"""
+    decompressor = zlib.decompressobj()
+    data = bytes(archive.data)
+    tail = b''
+    for offset in range(0, len(data), 64 * 1024):
+        tail += decompressor.decompress(data[offset:offset + 64 * 1024])
+        *lines, tail = tail.split(b'\n')
+        for line in lines:
+            yield _row(line)
+    tail += decompressor.flush()
+    for line in tail.split(b'\n'):
+        if line:
+            yield _row(line)
+
+
+def _row(line):
+    kind, *values = json.loads(line)
+    if kind == 'p':
+        return 'participant', dict(zip(PARTICIPANT_FIELDS, values))
+    return 'answer', dict(zip(ANSWER_FIELDS, values))
@@ -0,0 +1,250 @@
+import time
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import Http404, JsonResponse
+from django.shortcuts import render, redirect
+from django.utils import timezone
+from .analytics import send_answer
+from .answers import accept_answer, write_answers
+from .broadcast import send_room_delta
+from .forms import JoinQuizForm
+from .joining import NicknameTaken, join_session
+from .models import QuizSession, Participant
+from .results import materialize_results
+from .scheduler import Room, skip_question, time_left as get_time_left
+from .snapshot import get_snapshot
+from .state import get_loaded_state, seed_store
+from .store import get_store, run_store
+
+# Асинхронные версии горячих view: под ASGI запрос не занимает поток, пока ждет БД или кэш.
+# Синхронные версии в views.py остаются для WSGI и включаются QUIZ_ASYNC_VIEWS = False.
+# Сессия, пользователь и контекстные процессоры шаблонов в Django 4.2 синхронные и вызываются
+# через sync_to_async; ответы при загруженном состоянии комнаты уходят в ее буфер без потока.
+# Присоединение и ответ по HTTP учитываются в состоянии комнаты так же, как по WebSocket; без состояния
+# в процессе они рассылаются группе комнаты, и их учитывают воркеры с сокетами комнаты.
+
+
+async def _render(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+def _user_id(request):
+    return request.user.id if request.user.is_authenticated else None
+
+
+def _remember_participant(request, participant_id, session_code):
+    request.session['participant_id'] = participant_id
+    request.session['session_code'] = session_code
+
+
+async def join_quiz(request):
+    if request.method == 'POST':
+        form = JoinQuizForm(request.POST)
+        if form.is_valid():
+            session_code = form.cleaned_data['session_code']
+            nickname = form.cleaned_data['nickname']
+
+            session_id = await QuizSession.objects.filter(
+                session_code=session_code, is_active=True
+            ).values_list('id', flat=True).afirst()
+            if session_id is None:
+                messages.error(request, 'Сесію не знайдено або вона завершена!')
+                return await _render(request, 'quiz/join_quiz.html', {'form': form})
+
+            try:
+                participant = await sync_to_async(join_session)(
+                    session_id, nickname, await sync_to_async(_user_id)(request)
+                )
+            except NicknameTaken:
+                messages.error(request, 'Нікнейм вже зайнятий!')
+                return await _render(request, 'quiz/join_quiz.html', {'form': form})
+
+            state = get_loaded_state(session_code)
+            if state is not None:
+                state.broadcast.participant_added(state.add_participant(participant.id, participant.nickname))
+            else:
+                await send_room_delta(Room(session_id, session_code, get_store()), added=[
+                    {'id': participant.id, 'nickname': participant.nickname, 'score': 0, 'time': 0}
+                ])
+
+            await sync_to_async(_remember_participant)(request, participant.id, session_code)
+            return redirect('quiz:play_quiz', session_code=session_code)
+    else:
+        form = JoinQuizForm()
+
+    return await _render(request, 'quiz/join_quiz.html', {'form': form})
+
+
+async def play_quiz(request, session_code):
+    session = await QuizSession.objects.select_related('quiz').filter(
+        session_code=session_code, is_active=True
+    ).afirst()
+    if session is None:
+        raise Http404
+
+    participant_id = await sync_to_async(request.session.get)('participant_id')
+    if not participant_id:
+        return redirect('quiz:join_quiz')
+    participant = await Participant.objects.filter(id=participant_id, session=session).afirst()
+    if participant is None:
+        return redirect('quiz:join_quiz')
+
+    snapshot = await sync_to_async(get_snapshot)(session.quiz_id)
+    sequence = snapshot.sequence(session.question_order)
+    state = get_loaded_state(session_code)
+    if state is not None:
+        store = state.store
+    else:
+        store = await sync_to_async(seed_store)(session.id, session.current_question_id, session.is_active)
+
+    if request.method == 'POST':
+        received_at = time.time()
+        question_id = request.POST.get('question_id')
+        answer_id = request.POST.get('answer_id')
+
+        if question_id and answer_id:
+            try:
+                question_index = snapshot.index_of[int(question_id)]
+                answer_question_index, is_correct = snapshot.answer_index[int(answer_id)]
+            except (KeyError, ValueError):
+                raise Http404
+            if answer_question_index != question_index:
+                raise Http404
+            question = snapshot.questions[question_index]
+            # Открытие и дедлайн вопроса: по таймеру комнаты в этом процессе или из общего хранилища
+            timing = state.question_timing(question_index) if state is not None else None
+            if timing is None:
+                timing = await run_store(store, store.get_timing, session.id)
+
+            accepted = await run_store(
+                store, accept_answer, store, snapshot, session.id, participant.id, question_index, is_correct,
+                received_at, timing, sequence
+            )
+            if accepted is not None:
+                participant.score = accepted['score']
+                row = (
+                    participant.id, question['id'], int(answer_id), is_correct,
+                    accepted['points'], accepted['response_ms'], timezone.now()
+                )
+                room = state if state is not None else Room(session.id, session_code, store, snapshot, sequence)
+                if state is not None:
+                    # Комната загружена в этом процессе: ответ учитывается как ответ по WebSocket
+                    # и пишется пакетом вместе с ними
+                    await state.ensure_participant(participant.id)
+                    state.set_score(participant.id, accepted['score'], accepted['time'])
+                    state.answers.add(*row)
+                    state.analytics.answer_added(question['id'], int(answer_id))
+                    state.broadcast.participant_answered(participant.id, accepted['score'], accepted['time'])
+                else:
+                    await sync_to_async(write_answers)([row])
+                    await send_room_delta(room, scores=[
+                        {'id': participant.id, 'score': accepted['score'], 'time': accepted['time']}
+                    ], answered=[participant.id])
+                    position = sequence.position_of.get(question['id'])
+                    if position is not None:
+                        await send_answer(session_code, participant.id, position, question['id'], int(answer_id))
+
+                # В комнате без таймера первый ответ закрывает вопрос, как и раньше; вопрос с дедлайном
+                # закрывают только дедлайн и ведущий. Смена идет через планировщик и рассылается комнате
+                if timing is None or timing[2] is None:
+                    await skip_question(room, question['id'])
+
+    current_question = snapshot.question(await run_store(store, store.get_current, session.id))
+    if not current_question or not await run_store(store, store.is_active, session.id):
+        return redirect('quiz:quiz_results', session_code=session_code)
+
+    current_index = snapshot.index_of[current_question['id']]
+    # Дедлайн общий для всех воркеров; вопрос, открытый без таймера, показывается с полным временем
+    timing = state.question_timing(current_index) if state is not None else None
+    if timing is None:
+        timing = await run_store(store, store.get_timing, session.id)
+    time_left = get_time_left(timing, current_question['id'])
+    if time_left is None:
+        time_left = snapshot.time_per_question
+
+    return await _render(request, 'quiz/play_quiz.html', {
+        'session': session,
+        'participant': participant,
+        'current_question': current_question,
+        'answers': current_question['answers'],
+        'next_image': snapshot.prefetch(sequence.next_index(current_question['id'])),
+        'time_left': int(time_left)
+    })
+
+
+async def quiz_results(request, session_code):
+    session = await QuizSession.objects.select_related('quiz').filter(session_code=session_code).afirst()
+    if session is None:
+        raise Http404
+    questions = None
+
+    state = get_loaded_state(session_code)
+    if not session.is_active:
+        result = await sync_to_async(materialize_results)(session.id)
+        participants = result.ranking
+        question_count = result.question_count
+        questions = result.questions
+    elif state is not None:
+        usernames = {
+            participant_id: username
+            async for participant_id, username in session.participants.filter(
+                user__isnull=False
+            ).values_list('id', 'user__username')
+        }
+        participants = [dict(participant, username=usernames.get(participant['id'])) for participant in state.ranking()]
+        question_count = len(state.sequence)
+    else:
+        participants = []
+        async for participant in session.participants.order_by('-score', 'response_ms', 'id').values(
+            'id', 'nickname', 'score', 'user__username'
+        ):
+            participants.append({
+                'id': participant['id'],
+                'nickname': participant['nickname'],
+                'username': participant['user__username'],
+                'score': participant['score'],
+                'rank': len(participants) + 1,
+            })
+        question_count = len((await sync_to_async(get_snapshot)(session.quiz_id)).sequence(session.question_order))
+
+    participant_id = await sync_to_async(request.session.get)('participant_id')
+    current_participant = next((p for p in participants if p['id'] == participant_id), None)
+
+    return await _render(request, 'quiz/quiz_results.html', {
+        'session': session,
+        'participants': participants,
+        'current_participant': current_participant,
+        'question_count': question_count,
+        'questions': questions
+    })
+
+
+async def next_question(request, session_code):
+    if request.method == 'POST':
+        session = await QuizSession.objects.select_related('quiz').filter(session_code=session_code).afirst()
+        if session is None:
+            raise Http404
+        # Вопросы переключает только создатель викторины, как и команды ведущего по WebSocket
+        user_id = await sync_to_async(_user_id)(request)
+        if user_id is None or user_id != session.quiz.creator_id:
+            return JsonResponse({'success': False}, status=403)
+        try:
+            question_id = int(request.POST.get('question_id'))
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False})
+        state = get_loaded_state(session_code)
+        if state is not None:
+            store = state.store
+        else:
+            store = await sync_to_async(seed_store)(session.id, session.current_question_id, session.is_active)
+
+        snapshot = await sync_to_async(get_snapshot)(session.quiz_id)
+        sequence = snapshot.sequence(session.question_order)
+        # Смена вопроса идет через планировщик: комната получает новый вопрос, воркеры — его дедлайн
+        changed = await skip_question(
+            state if state is not None else Room(session.id, session_code, store, snapshot, sequence), question_id
+        )
+
+        return JsonResponse({'success': changed})
+
+    return JsonResponse({'success': False})
@@ -0,0 +1,102 @@
+import asyncio
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .metrics import metrics
+from .protocol import group_event
+from .store import run_store
+
+BROADCAST_TICK = getattr(settings, 'QUIZ_BROADCAST_TICK', 0.25)
+
+
+def room_group(session_code):
+    return f'quiz_{session_code}'
+
+
+def host_group(session_code):
+    """Группа сокетов ведущего: живая аналитика не рассылается участникам"""
+    return f'quiz_{session_code}_host'
+
+
+async def send_to_room(state, message_type, fields, **extra):
+    """Рассылка события комнате: номер события для возобновления, учет количества и размера кадров"""
+    layer = get_channel_layer()
+    if layer is None:
+        # Без слоя каналов (развертывание только с HTTP) рассылать некому
+        return
+    seq = await run_store(state.store, state.store.next_seq, state.session_id)
+    event = group_event(message_type, dict(fields, seq=seq), seq=seq, **extra)
+    metrics.record_send(message_type, len(event['text'].encode()))
+    await layer.group_send(room_group(state.session_code), event)
+
+
+async def send_room_delta(state, added=(), scores=(), answered=()):
+    """Кадр изменений комнаты; state — состояние комнаты или Room (HTTP-запрос без состояния в памяти)
+
+    Воркеры с сокетами комнаты учитывают изменения в своем состоянии (SessionState.apply_delta).
+    """
+    added, scores, answered = list(added), list(scores), list(answered)
+    await send_to_room(state, 'room_delta', {
+        'added': added,
+        'scores': scores,
+        'answered': answered,
+    }, added=added, scores=scores)
+
+
+class RoomBroadcaster:
+    """Накопление изменений комнаты и рассылка их одним кадром не чаще раза за тик"""
+
+    def __init__(self, state, tick=BROADCAST_TICK):
+        self.state = state
+        self.tick = tick
+        # participant_id -> {'id', 'nickname', 'score', 'time'} для присоединившихся с прошлого кадра
+        self._added = {}
+        # participant_id -> (новый счет, время ответов в мс)
+        self._scores = {}
+        self._answered = set()
+        self._timer = None
+        self._last_sent = None
+        self._tasks = set()
+
+    def participant_added(self, participant):
+        self._added[participant['id']] = dict(participant)
+        self._schedule()
+
+    def participant_answered(self, participant_id, score, time):
+        self._answered.add(participant_id)
+        if participant_id in self._added:
+            self._added[participant_id].update(score=score, time=time)
+        else:
+            self._scores[participant_id] = (score, time)
+        self._schedule()
+
+    def _schedule(self):
+        if self._timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = 0 if self._last_sent is None else max(0, self._last_sent + self.tick - loop.time())
+        self._timer = loop.call_later(delay, self._spawn)
+
+    def _spawn(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Немедленная рассылка накопленных изменений (если они есть)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not (self._added or self._scores or self._answered):
+            return
+
+        added = list(self._added.values())
+        scores = [
+            {'id': participant_id, 'score': score, 'time': time}
+            for participant_id, (score, time) in self._scores.items()
+        ]
+        answered = list(self._answered)
+        self._added = {}
+        self._scores = {}
+        self._answered = set()
+        self._last_sent = asyncio.get_running_loop().time()
+        await send_room_delta(self.state, added, scores, answered)
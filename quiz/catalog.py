@@ -0,0 +1,82 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.db.models import Q
+from .models import Quiz
+
+CATALOG_PAGE_SIZE = getattr(settings, 'QUIZ_CATALOG_PAGE_SIZE', 24)
+# Время жизни кэша фрагментов; счетчики игр в нем обновляются не чаще этого интервала
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'QUIZ_CATALOG_CACHE_TIMEOUT', 5 * 60)
+# За какой период считаются игры для рейтинга популярности
+POPULAR_WINDOW = timedelta(days=getattr(settings, 'QUIZ_POPULAR_WINDOW_DAYS', 30))
+
+_VERSION_KEY = 'quiz_catalog_version'
+
+
+def catalog_version():
+    """Версия каталога для ключей кэша фрагментов"""
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        cache.add(_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def invalidate_catalog():
+    cache.set(_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def popular_quizzes(limit):
+    """Активные викторины по числу игроков за последние POPULAR_WINDOW"""
+    return Quiz.objects.filter(is_active=True).with_stats(
+        since=timezone.now() - POPULAR_WINDOW
+    ).order_by('-recent_play_count', '-play_count', '-created_at')[:limit]
+
+
+def recent_quizzes(limit):
+    return Quiz.objects.filter(is_active=True).select_related('creator').order_by('-created_at', '-id')[:limit]
+
+
+class KeysetPage:
+    """Страница каталога по ключу (created_at, id): без OFFSET, одинаково быстро на любой глубине"""
+
+    def __init__(self, queryset, cursor=None, size=CATALOG_PAGE_SIZE):
+        self.queryset = queryset.order_by('-created_at', '-id')
+        self.cursor = cursor
+        self.size = size
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Разбор курсора вида '<created_at>_<id>'; None для пустого или испорченного"""
+        if not cursor:
+            return None
+        created_at, _, pk = cursor.rpartition('_')
+        created_at = parse_datetime(created_at)
+        if created_at is None or not pk.isdigit():
+            return None
+        return created_at, int(pk)
+
+    # Страница вычисляется при первом обращении, поэтому при попадании в кэш фрагмента запроса нет
+    @cached_property
+    def _rows(self):
+        queryset = self.queryset
+        position = self.parse_cursor(self.cursor)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return list(queryset[:self.size + 1])
+
+    @property
+    def object_list(self):
+        return self._rows[:self.size]
+
+    @property
+    def next_cursor(self):
+        if len(self._rows) <= self.size:
+            return None
+        last = self._rows[self.size - 1]
+        return f'{last.created_at.isoformat()}_{last.id}'
@@ -1,17 +1,31 @@
-import json
+import time
+from functools import partial
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import QuizSession, Participant, UserAnswer
+from .broadcast import host_group, room_group
+from .joining import join_session
+from .metrics import track
+from .protocol import MESSAGE_CODES, MSGPACK_SUBPROTOCOL, decode, encode, select_subprotocol
+from .scheduler import close_question, end_quiz, open_question
+from .state import acquire_state, release_state
 
 
 class QuizConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.session_code = self.scope['url_route']['kwargs']['session_code']
-        self.room_group_name = f'quiz_{self.session_code}'
+        self.room_group_name = room_group(self.session_code)
+        # Подписан ли сокет на аналитику ведущего
+        self.watching = False
         
-        # Проверяем существование сессии
-        session = await self.get_session()
-        if not session:
+        # Состояние сессии загружается из БД один раз на процесс
+        self.state = await acquire_state(self.session_code)
+        if not self.state:
+            await self.close()
+            return
+        if not self.state.is_active:
+            await release_state(self.state)
+            self.state = None
             await self.close()
             return
         
@@ -21,244 +35,206 @@ class QuizConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        await self.accept()
+        # Клиент может запросить компактный протокол (msgpack) через подпротокол WebSocket
+        subprotocol = select_subprotocol(self.scope.get('subprotocols', []))
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        await self.accept(subprotocol)
         
-        # Отправляем информацию о сессии
-        await self.send(text_data=json.dumps({
-            'type': 'session_info',
-            'session_code': self.session_code,
-            'quiz_title': session.quiz.title,
-            'current_question': await self.get_current_question_info()
-        }))
+        # Переподключившийся клиент передает номер последнего полученного события: ?resume=<seq>
+        resume = parse_qs(self.scope.get('query_string', b'').decode()).get('resume')
+        if resume and resume[0].isdigit():
+            await self.handle_resume({'since': int(resume[0])})
+        else:
+            await self.send_session_info()
     
     async def disconnect(self, close_code):
+        if not getattr(self, 'state', None):
+            return
+        
         # Покидаем группу
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-    
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+        if self.watching:
+            await self.channel_layer.group_discard(host_group(self.session_code), self.channel_name)
+        await release_state(self.state)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        # Время ответа считается от получения кадра сервером, а не по часам клиента
+        received_at = time.time()
+        data = decode(text_data, bytes_data)
         message_type = data.get('type')
         
-        if message_type == 'join_quiz':
-            await self.handle_join_quiz(data)
-        elif message_type == 'submit_answer':
-            await self.handle_submit_answer(data)
-        elif message_type == 'next_question':
-            await self.handle_next_question()
-        elif message_type == 'end_quiz':
-            await self.handle_end_quiz()
+        with track('ws', message_type if message_type in MESSAGE_CODES else 'unknown', self.session_code):
+            if message_type == 'join_quiz':
+                await self.handle_join_quiz(data)
+            elif message_type == 'submit_answer':
+                await self.handle_submit_answer(data, received_at)
+            elif message_type == 'resume':
+                await self.handle_resume(data)
+            elif message_type == 'watch_analytics':
+                await self.handle_watch_analytics()
+            elif message_type == 'start_quiz':
+                await self.handle_start_quiz()
+            elif message_type == 'next_question':
+                await self.handle_next_question(data)
+            elif message_type == 'end_quiz':
+                await self.handle_end_quiz()
+    
+    async def send_session_info(self):
+        """Полный снимок комнаты: при подключении и когда пропущенных событий уже нет в журнале"""
+        await self.send_frame(self.state.session_info())
+    
+    async def send_frame(self, frame):
+        """Отправка готового кадра в формате, выбранном клиентом"""
+        if self.binary:
+            await self.send(bytes_data=frame['bytes'])
+        else:
+            await self.send(text_data=frame['text'])
     
     async def handle_join_quiz(self, data):
         """Обработка присоединения к викторине"""
         nickname = data.get('nickname')
-        user_id = data.get('user_id')
+        # Аккаунт участника берется из сессии соединения, а не из сообщения клиента
+        user = self.scope.get('user')
+        user_id = user.id if user is not None and user.is_authenticated else None
         
         participant = await self.create_participant(nickname, user_id)
         
         if participant:
-            # Отправляем обновленную информацию об участниках
-            participants = await self.get_participants()
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'participants_update',
-                    'participants': participants
-                }
+            # Новый участник уходит в комнату вместе с остальными изменениями ближайшего кадра
+            self.state.broadcast.participant_added(
+                self.state.add_participant(participant.id, participant.nickname)
             )
     
-    async def handle_submit_answer(self, data):
+    async def handle_submit_answer(self, data, received_at):
         """Обработка ответа пользователя"""
-        participant_id = data.get('participant_id')
-        answer_id = data.get('answer_id')
+        try:
+            participant_id = int(data.get('participant_id'))
+            answer_id = int(data.get('answer_id'))
+        except (TypeError, ValueError):
+            return
         
-        result = await self.process_answer(participant_id, answer_id)
+        if await self.state.ensure_participant(participant_id) is None:
+            return
+        
+        result = await self.state.submit_answer(participant_id, answer_id, received_at)
         
         if result:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'answer_result',
-                    'participant_id': participant_id,
-                    'is_correct': result['is_correct'],
-                    'score': result['score']
-                }
-            )
+            # Результат получает только ответивший (с соседями по рейтингу), комната видит изменение
+            # счета в ближайшем кадре
+            await self.send_frame(encode(
+                'answer_result',
+                participant_id=participant_id,
+                is_correct=result['is_correct'],
+                points=result['points'],
+                score=result['score'],
+                rank=result['rank'],
+                neighbours=result['neighbours']
+            ))
+            self.state.broadcast.participant_answered(participant_id, result['score'], result['time'])
+    
+    async def handle_resume(self, data):
+        """Повтор пропущенных событий комнаты из журнала в памяти (или снимок, если клиент отстал слишком сильно)"""
+        try:
+            since = int(data.get('since'))
+        except (TypeError, ValueError):
+            since = None
+        frames = self.state.events.since(since) if since is not None else None
+        if frames is None:
+            await self.send_session_info()
+            return
+        for frame in frames:
+            await self.send_frame(frame)
     
-    async def handle_next_question(self):
-        """Переход к следующему вопросу"""
-        next_question = await self.get_next_question()
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'next_question',
-                'question': next_question
-            }
-        )
+    def is_host(self):
+        """Управлять комнатой и смотреть аналитику может только создатель викторины"""
+        user = self.scope.get('user')
+        return user is not None and user.is_authenticated and user.id == self.state.creator_id
+    
+    async def handle_watch_analytics(self):
+        """Подписка ведущего на живую аналитику комнаты (только для создателя викторины)"""
+        if not self.is_host():
+            return
+        if not self.watching:
+            self.watching = True
+            await self.channel_layer.group_add(host_group(self.session_code), self.channel_name)
+        await self.send_frame(self.state.analytics.frame())
+    
+    async def handle_start_quiz(self):
+        """Запуск таймера текущего вопроса; дальше вопросы сменяются по дедлайнам"""
+        if not self.is_host():
+            return
+        index = self.state.current_index
+        # Вопрос, открытый без таймера (комнату вели по HTTP), открывается заново с дедлайном
+        if index is not None and (self.state.timer.index != index or self.state.timer.deadline is None):
+            await open_question(self.state, index)
+    
+    async def handle_next_question(self, data):
+        """Досрочное закрытие вопроса, который видит ведущий, и переход к следующему
+        
+        Ведущий передает question_id закрываемого вопроса: повторное нажатие или команда, пришедшая
+        после дедлайна, относится к уже закрытому вопросу и следующий не пропускает.
+        """
+        if not self.is_host():
+            return
+        try:
+            question_id = int(data.get('question_id'))
+        except (TypeError, ValueError):
+            return
+        await close_question(self.state, self.state.snapshot.index_of.get(question_id))
     
     async def handle_end_quiz(self):
         """Завершение викторины"""
-        results = await self.get_quiz_results()
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'quiz_ended',
-                'results': results
-            }
-        )
+        if not self.is_host():
+            return
+        await end_quiz(self.state)
+    
+    # Кадры групповых событий сериализованы один раз отправителем и уходят всем сокетам как есть;
+    # каждое событие один раз на воркер попадает в журнал комнаты
     
-    async def participants_update(self, event):
-        """Отправка обновления списка участников"""
-        await self.send(text_data=json.dumps({
-            'type': 'participants_update',
-            'participants': event['participants']
-        }))
+    async def room_delta(self, event):
+        """Отправка накопленных изменений комнаты: новые участники, изменившиеся счета, ответившие"""
+        self.state.events.record(event)
+        self.state.apply_delta(event['added'], event['scores'])
+        await self.send_frame(event)
     
-    async def answer_result(self, event):
-        """Отправка результата ответа"""
-        await self.send(text_data=json.dumps({
-            'type': 'answer_result',
-            'participant_id': event['participant_id'],
-            'is_correct': event['is_correct'],
-            'score': event['score']
-        }))
+    async def leaderboard(self, event):
+        """Отправка текущего рейтинга"""
+        self.state.events.record(event)
+        await self.send_frame(event)
     
     async def next_question(self, event):
-        """Отправка следующего вопроса"""
-        await self.send(text_data=json.dumps({
-            'type': 'next_question',
-            'question': event['question']
-        }))
+        """Отправка следующего вопроса с серверным дедлайном (None — вопрос открыт без таймера)"""
+        # Вопрос мог открыть другой воркер: подхватываем его дедлайн (повторное открытие ничего не меняет)
+        self.state.events.record(event)
+        self.state.current_index = event['index']
+        self.state.timer.open(event['index'], event['opened'], event['deadline'], partial(close_question, self.state))
+        await self.send_frame(event)
+        if self.watching:
+            # Панель ведущего переключается на новый вопрос сразу, не дожидаясь первых ответов
+            await self.send_frame(self.state.analytics.frame())
     
     async def quiz_ended(self, event):
         """Отправка результатов викторины"""
-        await self.send(text_data=json.dumps({
-            'type': 'quiz_ended',
-            'results': event['results']
-        }))
-    
-    @database_sync_to_async
-    def get_session(self):
-        try:
-            return QuizSession.objects.get(session_code=self.session_code, is_active=True)
-        except QuizSession.DoesNotExist:
-            return None
-    
-    @database_sync_to_async
-    def get_current_question_info(self):
-        session = QuizSession.objects.get(session_code=self.session_code)
-        if session.current_question:
-            question = session.current_question
-            answers = list(question.answers.values('id', 'answer_text'))
-            return {
-                'id': question.id,
-                'text': question.question_text,
-                'type': question.question_type,
-                'image': question.image.url if question.image else None,
-                'video_url': question.video_url,
-                'answers': answers,
-                'time_limit': session.quiz.time_per_question
-            }
-        return None
+        self.state.events.record(event)
+        self.state.is_active = False
+        self.state.timer.cancel()
+        # Итоги ждут ответов из буферов всех воркеров: этот воркер записывает свой сразу
+        await self.state.answers.flush()
+        await self.send_frame(event)
+    
+    async def analytics(self, event):
+        """Изменения счетчиков ответов от воркера комнаты: ведущему уходит свежий кадр панели"""
+        self.state.analytics.apply(event)
+        await self.send_frame(self.state.analytics.frame())
     
     @database_sync_to_async
     def create_participant(self, nickname, user_id):
-        try:
-            session = QuizSession.objects.get(session_code=self.session_code)
-            user = None
-            if user_id:
-                from django.contrib.auth.models import User
-                user = User.objects.get(id=user_id)
-            
-            participant = Participant.objects.create(
-                session=session,
-                user=user,
-                nickname=nickname
-            )
-            return participant
-        except Exception:
+        if not nickname:
             return None
-    
-    @database_sync_to_async
-    def get_participants(self):
-        session = QuizSession.objects.get(session_code=self.session_code)
-        return list(session.participants.values('id', 'nickname', 'score'))
-    
-    @database_sync_to_async
-    def process_answer(self, participant_id, answer_id):
         try:
-            participant = Participant.objects.get(id=participant_id)
-            answer = Answer.objects.get(id=answer_id)
-            
-            # Проверяем, не отвечал ли уже
-            if UserAnswer.objects.filter(participant=participant, question=answer.question).exists():
-                return None
-            
-            # Создаем запись об ответе
-            UserAnswer.objects.create(
-                participant=participant,
-                question=answer.question,
-                answer=answer,
-                is_correct=answer.is_correct
-            )
-            
-            # Обновляем счет
-            if answer.is_correct:
-                participant.score += 1
-                participant.save()
-            
-            return {
-                'is_correct': answer.is_correct,
-                'score': participant.score
-            }
+            return join_session(self.state.session_id, nickname, user_id)
         except Exception:
             return None
-    
-    @database_sync_to_async
-    def get_next_question(self):
-        session = QuizSession.objects.get(session_code=self.session_code)
-        questions = list(session.quiz.questions.all().order_by('order'))
-        
-        if not questions:
-            return None
-        
-        current_order = session.current_question.order if session.current_question else 0
-        next_question = None
-        
-        for question in questions:
-            if question.order > current_order:
-                next_question = question
-                break
-        
-        if next_question:
-            session.current_question = next_question
-            session.save()
-            
-            answers = list(next_question.answers.values('id', 'answer_text'))
-            return {
-                'id': next_question.id,
-                'text': next_question.question_text,
-                'type': next_question.question_type,
-                'image': next_question.image.url if next_question.image else None,
-                'video_url': next_question.video_url,
-                'answers': answers,
-                'time_limit': session.quiz.time_per_question
-            }
-        
-        return None
-    
-    @database_sync_to_async
-    def get_quiz_results(self):
-        session = QuizSession.objects.get(session_code=self.session_code)
-        participants = list(session.participants.all().order_by('-score').values(
-            'id', 'nickname', 'score'
-        ))
-        
-        session.is_active = False
-        session.save()
-        
-        return participants
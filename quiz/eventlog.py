@@ -0,0 +1,44 @@
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+
+EVENT_LOG_SIZE = getattr(settings, 'QUIZ_EVENT_LOG_SIZE', 256)
+
+
+class EventLog:
+    """Кольцевой буфер последних событий комнаты с номерами для возобновления после переподключения"""
+
+    def __init__(self, size=EVENT_LOG_SIZE):
+        self.size = size
+        # Номера событий по возрастанию и их кадры: события разных воркеров могут прийти не по порядку
+        self._seqs = []
+        self._frames = []
+        self.last_seq = 0
+
+    def record(self, event):
+        seq = event['seq']
+        index = bisect_left(self._seqs, seq)
+        # Событие приходит каждому сокету воркера, в буфер оно попадает один раз
+        if index < len(self._seqs) and self._seqs[index] == seq:
+            return
+        # Опоздавшее событие старше всего буфера уже не нужно: клиенту с таким seq отдается снимок
+        if index == 0 and len(self._seqs) >= self.size:
+            return
+        self._seqs.insert(index, seq)
+        self._frames.insert(index, {'text': event['text'], 'bytes': event.get('bytes')})
+        if len(self._seqs) > self.size:
+            del self._seqs[0]
+            del self._frames[0]
+        self.last_seq = max(self.last_seq, seq)
+
+    def since(self, seq):
+        """Кадры после seq; None, если нужен полный снимок
+
+        Снимок нужен, когда часть кадров вытеснена или еще не дошла до этого воркера (пропуск в номерах),
+        а также когда клиент видел события новее известных здесь (он был подключен к другому воркеру).
+        """
+        if seq > self.last_seq:
+            return None
+        start = bisect_right(self._seqs, seq)
+        if self._seqs[start:] != list(range(seq + 1, self.last_seq + 1)):
+            return None
+        return self._frames[start:]
@@ -5,11 +5,12 @@ from .models import Quiz, Question, Answer
 class QuizForm(forms.ModelForm):
     class Meta:
         model = Quiz
-        fields = ['title', 'description', 'time_per_question']
+        fields = ['title', 'description', 'time_per_question', 'scoring_mode']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'time_per_question': forms.NumberInput(attrs={'class': 'form-control', 'min': 5, 'max': 300}),
+            'scoring_mode': forms.Select(attrs={'class': 'form-control'}),
         }
 
 
@@ -24,6 +25,14 @@ class QuestionForm(forms.ModelForm):
             'video_url': forms.URLInput(attrs={'class': 'form-control'}),
             'order': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
         }
+    
+    def clean_order(self):
+        order = self.cleaned_data['order']
+        if self.instance.quiz_id is not None and Question.objects.filter(
+            quiz_id=self.instance.quiz_id, order=order
+        ).exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError('Вопрос с таким порядковым номером уже есть в викторине')
+        return order
 
 
 class AnswerForm(forms.ModelForm):
@@ -41,6 +50,13 @@ AnswerFormSet = forms.inlineformset_factory(
 )
 
 
+class QuestionImportForm(forms.Form):
+    file = forms.FileField(
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.jsonl,.csv,.zip'}),
+        label='Файл вопросов'
+    )
+
+
 class JoinQuizForm(forms.Form):
     session_code = forms.CharField(
         max_length=20,
@@ -0,0 +1,34 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from .models import Participant
+
+# Никнеймы резервируются в общем кэше: повторные попытки наплыва отсекаются без обращения к БД
+NICKNAME_RESERVATION = getattr(settings, 'QUIZ_NICKNAME_RESERVATION', True)
+NICKNAME_RESERVATION_TIMEOUT = getattr(settings, 'QUIZ_NICKNAME_RESERVATION_TIMEOUT', 24 * 60 * 60)
+
+
+class NicknameTaken(Exception):
+    pass
+
+
+def _reservation_key(session_id, nickname):
+    return f'quiz_nickname:{session_id}:{hashlib.md5(nickname.encode()).hexdigest()}'
+
+
+def join_session(session_id, nickname, user_id=None):
+    """Новый участник сессии одной вставкой; уникальность никнейма проверяет ограничение (session, nickname)"""
+    key = _reservation_key(session_id, nickname)
+    if NICKNAME_RESERVATION and not cache.add(key, 1, NICKNAME_RESERVATION_TIMEOUT):
+        raise NicknameTaken(nickname)
+    try:
+        with transaction.atomic():
+            return Participant.objects.create(session_id=session_id, user_id=user_id, nickname=nickname)
+    except IntegrityError:
+        raise NicknameTaken(nickname)
+    except Exception:
+        # Никнейм не занят, резерв снимается
+        if NICKNAME_RESERVATION:
+            cache.delete(key)
+        raise
@@ -0,0 +1,67 @@
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """Рейтинг участников сессии, обновляемый при каждом изменении счета без полной сортировки
+
+    Ключи лежат в отсортированном списке: место ищется бинарным поиском за O(log n), но вставка и удаление
+    сдвигают хвост списка, поэтому обновление счета стоит O(n) на копирование памяти (memmove). Для комнат
+    в тысячи участников это единицы микросекунд, заметно дешевле сортировки всего рейтинга на каждый ответ.
+    """
+
+    def __init__(self, scores=()):
+        # participant_id -> ключ (-счет, суммарное время ответов, participant_id)
+        self._entries = {
+            participant_id: (-score, time, participant_id)
+            for participant_id, (score, time) in dict(scores).items()
+        }
+        # Ключи по возрастанию: при равном счете выше ответивший быстрее, затем присоединившийся раньше
+        self._keys = sorted(self._entries.values())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, participant_id):
+        return participant_id in self._entries
+
+    def set_score(self, participant_id, score, time=0):
+        key = (-score, time, participant_id)
+        old = self._entries.get(participant_id)
+        if old == key:
+            return
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        self._entries[participant_id] = key
+        insort(self._keys, key)
+
+    def remove(self, participant_id):
+        key = self._entries.pop(participant_id, None)
+        if key is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def score(self, participant_id):
+        key = self._entries.get(participant_id)
+        return None if key is None else -key[0]
+
+    def rank(self, participant_id):
+        """Место участника начиная с 1 (None, если участника нет)"""
+        key = self._entries.get(participant_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1
+
+    def top(self, k=None):
+        """Первые k участников в виде (participant_id, счет); все, если k не задано"""
+        keys = self._keys if k is None else self._keys[:k]
+        return [(participant_id, -score) for score, _, participant_id in keys]
+
+    def around(self, participant_id, radius=2):
+        """Участники с местами от rank - radius до rank + radius в виде (место, participant_id, счет)"""
+        rank = self.rank(participant_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        return [
+            (start + offset + 1, pid, -score)
+            for offset, (score, _, pid) in enumerate(self._keys[start:rank + radius])
+        ]
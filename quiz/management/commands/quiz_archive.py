@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from quiz.archive import ARCHIVE_AFTER, archivable_sessions, archive_session
+
+
+class Command(BaseCommand):
+    help = 'Перенос участников и ответов давно завершенных сессий в сжатые архивы (итоги сессий остаются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER.days, help='Архивировать сессии старше N дней')
+        parser.add_argument('--limit', type=int, default=None, help='Не больше N сессий за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько сессий будет перенесено')
+
+    def handle(self, *args, **options):
+        session_ids = archivable_sessions(timezone.now() - timedelta(days=options['days']))
+        if options['limit']:
+            session_ids = session_ids[:options['limit']]
+        if options['dry_run']:
+            self.stdout.write(f'Сессий к архивации: {session_ids.count()}')
+            return
+
+        sessions = participants = answers = 0
+        # Каждая сессия переносится своей транзакцией: прерванный запуск можно просто повторить
+        for session_id in list(session_ids):
+            archive = archive_session(session_id)
+            if archive is None:
+                continue
+            sessions += 1
+            participants += archive.participant_count
+            answers += archive.answer_count
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Сессия {session_id}: {archive.participant_count} участников, {archive.answer_count} ответов, {len(archive.data)} байт')
+        self.stdout.write(f'Перенесено сессий: {sessions}, участников: {participants}, ответов: {answers}')
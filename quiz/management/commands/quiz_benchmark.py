@@ -0,0 +1,289 @@
+import asyncio
+import json
+import random
+import string
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from quiz import async_views
+from quiz.models import Quiz, Question, Answer, QuizSession
+from quiz.routing import websocket_urlpatterns
+from quiz.views import join_quiz, play_quiz, quiz_results
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class QueryCounter:
+    """Счетчик запросов к БД для connection.execute_wrapper"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started
+
+
+class Player:
+    """Один WebSocket-клиент комнаты, запущенный в процессе через WebsocketCommunicator"""
+
+    def __init__(self, application, session_code, nickname, timeout, user=None):
+        self.communicator = WebsocketCommunicator(application, f'/ws/quiz/{session_code}/')
+        # Командами комнаты управляет только создатель викторины
+        self.communicator.scope['user'] = user or AnonymousUser()
+        self.nickname = nickname
+        self.timeout = timeout
+        self.participant_id = None
+        self.frames = 0
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=self.timeout)
+        if not connected:
+            raise RuntimeError(f'{self.nickname}: подключение отклонено')
+        await self.receive('session_info')
+
+    async def send(self, message_type, **fields):
+        await self.communicator.send_to(text_data=json.dumps({'type': message_type, **fields}))
+
+    async def receive(self, *message_types, predicate=None):
+        """Чтение кадров до первого кадра нужного типа; возвращает кадр и время его получения"""
+        while True:
+            frame = json.loads(await self.communicator.receive_from(timeout=self.timeout))
+            self.frames += 1
+            if frame['type'] in message_types and (predicate is None or predicate(frame)):
+                return frame, time.perf_counter()
+
+    async def join(self):
+        """Присоединение; участник считается вошедшим, когда комната получила его в room_delta"""
+        started = time.perf_counter()
+        await self.send('join_quiz', nickname=self.nickname)
+        frame, received_at = await self.receive(
+            'room_delta', predicate=lambda frame: any(p['nickname'] == self.nickname for p in frame['added'])
+        )
+        self.participant_id = next(p['id'] for p in frame['added'] if p['nickname'] == self.nickname)
+        return received_at - started
+
+    async def answer(self, question):
+        started = time.perf_counter()
+        await self.send(
+            'submit_answer',
+            participant_id=self.participant_id,
+            answer_id=random.choice(question['answers'])['id']
+        )
+        _, received_at = await self.receive('answer_result')
+        return received_at - started
+
+    async def disconnect(self):
+        await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон викторины: комнаты с игроками, наплыв ответов и сбор метрик'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1, help='Количество одновременных комнат')
+        parser.add_argument('--players', type=int, default=100, help='Игроков в каждой комнате')
+        parser.add_argument('--questions', type=int, default=10, help='Вопросов в викторине')
+        parser.add_argument('--timeout', type=float, default=30, help='Ожидание одного кадра, секунд')
+        parser.add_argument(
+            '--history', type=int, default=0,
+            help='Завершенных сессий в БД до прогона: время присоединения не должно от них зависеть'
+        )
+        parser.add_argument(
+            '--http-requests', type=int, default=0,
+            help='Одновременных запросов play_quiz для сравнения синхронной и асинхронной view'
+        )
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные')
+
+    def handle(self, *args, **options):
+        self.application = URLRouter(websocket_urlpatterns)
+        self.timeout = options['timeout']
+        self.http_requests = options['http_requests']
+        # session_code -> участник, присоединившийся через HTTP (для запросов play_quiz)
+        self.web_participants = {}
+        self.stats = {
+            'web_join': [], 'web_join_queries': [], 'join': [], 'answer': [], 'fanout': [], 'queries': [],
+            'results': [], 'http': {}, 'frames': 0,
+        }
+
+        games = [self.create_game(options['questions']) for _ in range(options['rooms'])]
+        counter = QueryCounter()
+        try:
+            if options['history']:
+                self.create_history(games[0][1], options['history'])
+            with connection.execute_wrapper(counter):
+                for _, session_code in games:
+                    self.web_join(session_code, options['players'], counter)
+            # Слой каналов в памяти процесса: измеряется сам QuizConsumer, а не сеть до Redis
+            with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}), \
+                    connection.execute_wrapper(counter):
+                self.counter = counter
+                started = time.perf_counter()
+                async_to_sync(self.run)(games, options['players'])
+                elapsed = time.perf_counter() - started
+        finally:
+            if not options['keep']:
+                for host, _ in games:
+                    host.delete()
+
+        self.report(options, elapsed, counter)
+
+    def create_game(self, questions):
+        """Ведущий, викторина с вопросами по четыре ответа и открытая сессия"""
+        token = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        host = User.objects.create_user(username=f'benchmark_{token}')
+        quiz = Quiz.objects.create(
+            title=f'Benchmark {token}',
+            description='Нагрузочный прогон',
+            creator=host,
+            code=token,
+        )
+        question_objects = Question.objects.bulk_create([
+            Question(quiz=quiz, question_text=f'Вопрос {order}', order=order)
+            for order in range(1, questions + 1)
+        ])
+        Answer.objects.bulk_create([
+            Answer(question=question, answer_text=f'Ответ {n}', is_correct=n == 0)
+            for question in question_objects
+            for n in range(4)
+        ])
+        session = QuizSession.objects.create(
+            quiz=quiz,
+            session_code=token,
+            current_question=question_objects[0]
+        )
+        return host, session.session_code
+
+    def create_history(self, session_code, count):
+        """Завершенные сессии той же викторины, как после долгой эксплуатации"""
+        quiz_id = QuizSession.objects.filter(session_code=session_code).values_list('quiz_id', flat=True).get()
+        QuizSession.objects.bulk_create([
+            QuizSession(quiz_id=quiz_id, session_code=f'{session_code}H{n}', is_active=False)
+            for n in range(count)
+        ], batch_size=1000)
+
+    def web_join(self, session_code, players, counter):
+        """Присоединение через форму join_quiz: время и запросы к БД на одного игрока"""
+        factory = RequestFactory()
+        for n in range(players):
+            request = factory.post('/join/', {'session_code': session_code, 'nickname': f'web{n}'})
+            request.session = {}
+            request.user = AnonymousUser()
+            queries = counter.count
+            started = time.perf_counter()
+            join_quiz(request)
+            self.stats['web_join'].append(time.perf_counter() - started)
+            self.stats['web_join_queries'].append(counter.count - queries)
+            self.web_participants[session_code] = request.session.get('participant_id')
+
+    def play_request(self, session_code):
+        request = RequestFactory().get(f'/play/{session_code}/')
+        request.session = {'participant_id': self.web_participants[session_code]}
+        request.user = AnonymousUser()
+        return request
+
+    async def compare_views(self, session_code):
+        """Пропускная способность play_quiz: синхронная view через sync_to_async, как ее запускает ASGI, и асинхронная"""
+        for label, view in [('sync', sync_to_async(play_quiz)), ('async', async_views.play_quiz)]:
+            started = time.perf_counter()
+            await asyncio.gather(*(view(self.play_request(session_code), session_code) for _ in range(self.http_requests)))
+            self.stats['http'].setdefault(label, []).append(self.http_requests / (time.perf_counter() - started))
+
+    async def run(self, games, players):
+        await asyncio.gather(*(self.run_room(host, session_code, players) for host, session_code in games))
+
+    async def run_room(self, host_user, session_code, players):
+        host = Player(self.application, session_code, 'host', self.timeout, host_user)
+        room = [Player(self.application, session_code, f'player{n}', self.timeout) for n in range(players)]
+        await host.connect()
+        await asyncio.gather(*(player.connect() for player in room))
+
+        # Наплыв присоединений
+        self.stats['join'].extend(await asyncio.gather(*(player.join() for player in room)))
+
+        if self.http_requests and self.web_participants.get(session_code):
+            await self.compare_views(session_code)
+
+        sent = time.perf_counter()
+        await host.send('start_quiz')
+        question = await self.fan_out(room, sent)
+        while question is not None:
+            queries = self.counter.count
+
+            # Все игроки отвечают одновременно, как перед дедлайном
+            self.stats['answer'].extend(await asyncio.gather(*(player.answer(question) for player in room)))
+
+            sent = time.perf_counter()
+            await host.send('next_question', question_id=question['id'])
+            question = await self.fan_out(room, sent)
+            self.stats['queries'].append(self.counter.count - queries)
+
+        for player in [host, *room]:
+            self.stats['frames'] += player.frames
+            await player.disconnect()
+
+        queries = self.counter.count
+        started = time.perf_counter()
+        await database_sync_to_async(self.fetch_results)(session_code)
+        self.stats['results'].append((time.perf_counter() - started, self.counter.count - queries))
+
+    async def fan_out(self, room, sent):
+        """Ожидание следующего вопроса (или итогов) у всех игроков; возвращает вопрос или None"""
+        received = await asyncio.gather(*(player.receive('next_question', 'quiz_ended') for player in room))
+        self.stats['fanout'].append(max(received_at for _, received_at in received) - sent)
+        frame = received[0][0]
+        return frame['question'] if frame['type'] == 'next_question' else None
+
+    def fetch_results(self, session_code):
+        request = RequestFactory().get(f'/results/{session_code}/')
+        request.session = {}
+        request.user = AnonymousUser()
+        quiz_results(request, session_code)
+
+    def report(self, options, elapsed, counter):
+        ms = 1000
+        stats = self.stats
+        self.stdout.write(
+            f"Комнат: {options['rooms']}, игроков в комнате: {options['players']}, вопросов: {options['questions']}, "
+            f"завершенных сессий в БД: {options['history']}"
+        )
+        for title, key in [
+            ('Присоединение через HTTP (join_quiz)', 'web_join'),
+            ('Присоединение (join_quiz -> room_delta)', 'join'),
+            ('Ответ (submit_answer -> answer_result)', 'answer'),
+            ('Рассылка вопроса (команда ведущего -> последний игрок)', 'fanout'),
+        ]:
+            values = stats[key]
+            self.stdout.write(
+                f'{title}: p50 {percentile(values, 50) * ms:.1f} мс, p99 {percentile(values, 99) * ms:.1f} мс'
+            )
+        for label, values in stats['http'].items():
+            self.stdout.write(f'play_quiz ({label}): {sum(values) / len(values):.0f} запросов в секунду')
+        web_join_queries = stats['web_join_queries']
+        self.stdout.write(f'Запросов к БД на присоединение через HTTP: максимум {max(web_join_queries, default=0)}')
+        queries = stats['queries']
+        self.stdout.write(
+            f'Запросов к БД на вопрос: в среднем {sum(queries) / max(len(queries), 1):.1f}, максимум {max(queries, default=0)}'
+        )
+        for result_time, result_queries in stats['results']:
+            self.stdout.write(f'Страница результатов: {result_time * ms:.1f} мс, запросов {result_queries}')
+        self.stdout.write(
+            f"Всего запросов: {counter.count} ({counter.time * ms:.0f} мс), "
+            f"кадров: {stats['frames']}, кадров в секунду: {stats['frames'] / elapsed:.0f}"
+        )
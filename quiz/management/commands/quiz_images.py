@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from quiz.media import build_variants
+from quiz.models import Question
+from quiz.snapshot import invalidate_quiz
+
+
+class Command(BaseCommand):
+    help = 'Построение вариантов изображений для вопросов, загруженных до появления обработки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перестроить и уже обработанные изображения')
+
+    def handle(self, *args, **options):
+        built = 0
+        quiz_ids = set()
+        for question in Question.objects.exclude(image='').exclude(image__isnull=True).only(
+            'id', 'quiz_id', 'image', 'image_width', 'image_height', 'image_variants'
+        ).iterator():
+            variants = question.image_variants
+            if not options['force'] and variants and variants.get('source') == question.image.name:
+                continue
+            try:
+                variants = build_variants(question.image)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Вопрос {question.id}: {error}')
+                continue
+            # Размеры старых изображений ImageField вычисляет при загрузке строки; здесь они сохраняются
+            Question.objects.filter(id=question.id).update(
+                image_variants=variants, image_width=question.image_width, image_height=question.image_height
+            )
+            quiz_ids.add(question.quiz_id)
+            built += 1
+        for quiz_id in quiz_ids:
+            invalidate_quiz(quiz_id)
+        self.stdout.write(f'Обработано изображений: {built}')
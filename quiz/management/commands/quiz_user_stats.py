@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from quiz.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Сверка статистики пользователей с полным пересчетом по завершенным сессиям и исправление расхождений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только показать расхождения, ничего не меняя')
+
+    def handle(self, *args, **options):
+        mismatched = rebuild_stats(dry_run=options['check'])
+        if mismatched:
+            shown = ', '.join(map(str, mismatched[:20])) + (' ...' if len(mismatched) > 20 else '')
+            self.stdout.write(f'Расхождений: {len(mismatched)} (пользователи {shown})')
+        else:
+            self.stdout.write('Расхождений нет')
+        if mismatched and not options['check']:
+            self.stdout.write('Статистика пересчитана')
@@ -0,0 +1,73 @@
+import hashlib
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+# Ширины вариантов изображения вопроса; больше оригинала не растягиваются
+IMAGE_WIDTHS = getattr(settings, 'QUIZ_IMAGE_WIDTHS', (320, 640, 1280))
+# Вариант для src: браузеры без srcset и клиенты, которым нужна одна ссылка
+IMAGE_DEFAULT_WIDTH = getattr(settings, 'QUIZ_IMAGE_DEFAULT_WIDTH', 640)
+IMAGE_QUALITY = getattr(settings, 'QUIZ_IMAGE_QUALITY', 80)
+IMAGE_FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()[:20]
+
+
+def question_image_path(instance, filename):
+    """Путь оригинала по хешу содержимого: новый файл всегда получает новый URL, старый можно кэшировать навсегда"""
+    return f'questions/{content_hash(instance.image)}{os.path.splitext(filename)[1].lower()}'
+
+
+def build_variants(image):
+    """Уменьшенные копии изображения в WebP и JPEG; имена по хешу содержимого, готовые файлы не пересоздаются"""
+    from PIL import Image, ImageOps
+
+    variants = []
+    # Оригинал читается из хранилища: загруженный файл к этому моменту уже может быть закрыт
+    with image.storage.open(image.name, 'rb') as file:
+        digest = content_hash(file)
+        with Image.open(file) as source:
+            source = ImageOps.exif_transpose(source).convert('RGB')
+    width, height = source.size
+    for target in sorted({min(target, width) for target in IMAGE_WIDTHS}):
+        resized = source if target == width else source.resize(
+            (target, max(1, round(height * target / width))), Image.LANCZOS
+        )
+        variant = {'width': target}
+        for extension, image_format in IMAGE_FORMATS:
+            name = f'questions/{digest}/{target}.{extension}'
+            if not image.storage.exists(name):
+                buffer = BytesIO()
+                resized.save(buffer, image_format, quality=IMAGE_QUALITY)
+                name = image.storage.save(name, ContentFile(buffer.getvalue()))
+            variant[extension] = name
+        variants.append(variant)
+    return {'source': image.name, 'variants': variants}
+
+
+def image_sources(image, variants, width=None, height=None):
+    """Данные изображения вопроса для клиента: src, srcset по форматам и размеры для разметки"""
+    if not image:
+        return None
+    if not variants or variants.get('source') != image.name:
+        # Варианты еще не построены: отдается оригинал
+        return {'src': image.url, 'srcset': None, 'width': width, 'height': height}
+    items = variants['variants']
+    default = min(items, key=lambda variant: abs(variant['width'] - IMAGE_DEFAULT_WIDTH))
+    return {
+        'src': image.storage.url(default['jpeg']),
+        'srcset': {
+            extension: ', '.join(f"{image.storage.url(variant[extension])} {variant['width']}w" for variant in items)
+            for extension, _ in IMAGE_FORMATS
+        },
+        'width': width,
+        'height': height,
+    }
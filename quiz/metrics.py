@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Доля операций, для которых считаются запросы к БД; время считается всегда
+SAMPLE_RATE = getattr(settings, 'QUIZ_METRICS_SAMPLE_RATE', 1.0)
+# Сколько последних сессий хранить в сводке для админки
+SESSION_LIMIT = getattr(settings, 'QUIZ_METRICS_SESSIONS', 1000)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Операция, к которой относятся запросы к БД текущего контекста (None, если не в выборке)
+_operation = ContextVar('quiz_metrics_operation', default=None)
+
+
+class Histogram:
+    """Гистограмма с заранее выделенными корзинами в формате Prometheus"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Operation:
+    """Одна обработка: запрос к view или сообщение WebSocket"""
+
+    __slots__ = ('kind', 'name', 'session_code', 'queries', 'query_time')
+
+    def __init__(self, kind, name, session_code):
+        self.kind = kind
+        self.name = name
+        self.session_code = session_code
+        self.queries = 0
+        self.query_time = 0.0
+
+
+class Metrics:
+    """Счетчики процесса: время обработок, запросы к БД, рассылки через слой каналов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (kind, name) -> Histogram
+        self.latency = {}
+        # (kind, name) -> [операций в выборке, запросов, секунд в БД]
+        self.queries = {}
+        # тип сообщения -> [рассылок, байт]
+        self.sends = {}
+        # session_code -> {'messages', 'seconds', 'max', 'sampled', 'queries'}
+        self.sessions = OrderedDict()
+
+    def record(self, operation, seconds, sampled):
+        key = (operation.kind, operation.name)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(seconds)
+            if sampled:
+                queries = self.queries.setdefault(key, [0, 0, 0.0])
+                queries[0] += 1
+                queries[1] += operation.queries
+                queries[2] += operation.query_time
+            if operation.session_code is not None:
+                self._record_session(operation, seconds, sampled)
+
+    def _record_session(self, operation, seconds, sampled):
+        summary = self.sessions.get(operation.session_code)
+        if summary is None:
+            summary = self.sessions[operation.session_code] = {
+                'messages': 0, 'seconds': 0.0, 'max': 0.0, 'sampled': 0, 'queries': 0,
+            }
+            if len(self.sessions) > SESSION_LIMIT:
+                self.sessions.popitem(last=False)
+        summary['messages'] += 1
+        summary['seconds'] += seconds
+        summary['max'] = max(summary['max'], seconds)
+        if sampled:
+            summary['sampled'] += 1
+            summary['queries'] += operation.queries
+
+    def record_send(self, message_type, size):
+        with self._lock:
+            sends = self.sends.setdefault(message_type, [0, 0])
+            sends[0] += 1
+            sends[1] += size
+
+    def session_summary(self, session_code):
+        with self._lock:
+            summary = self.sessions.get(session_code)
+            return dict(summary) if summary is not None else None
+
+    def render(self):
+        """Все счетчики в текстовом формате Prometheus"""
+        with self._lock:
+            lines = [
+                '# HELP quiz_latency_seconds Время обработки view и сообщений WebSocket',
+                '# TYPE quiz_latency_seconds histogram',
+            ]
+            for (kind, name), histogram in sorted(self.latency.items()):
+                labels = f'kind="{kind}",name="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'quiz_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'quiz_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'quiz_latency_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'quiz_latency_seconds_count{{{labels}}} {histogram.count}')
+
+            lines += [
+                '# HELP quiz_db_sampled_total Обработки, для которых считались запросы к БД',
+                '# TYPE quiz_db_sampled_total counter',
+                '# HELP quiz_db_queries_total Запросы к БД в обработках из выборки',
+                '# TYPE quiz_db_queries_total counter',
+                '# HELP quiz_db_query_seconds_total Время запросов к БД в обработках из выборки',
+                '# TYPE quiz_db_query_seconds_total counter',
+            ]
+            for (kind, name), (sampled, queries, seconds) in sorted(self.queries.items()):
+                labels = f'kind="{kind}",name="{_escape(name)}"'
+                lines.append(f'quiz_db_sampled_total{{{labels}}} {sampled}')
+                lines.append(f'quiz_db_queries_total{{{labels}}} {queries}')
+                lines.append(f'quiz_db_query_seconds_total{{{labels}}} {seconds}')
+
+            lines += [
+                '# HELP quiz_channel_sends_total Рассылки комнатам через слой каналов',
+                '# TYPE quiz_channel_sends_total counter',
+                '# HELP quiz_channel_send_bytes_total Размер разосланных кадров (JSON)',
+                '# TYPE quiz_channel_send_bytes_total counter',
+            ]
+            for message_type, (count, size) in sorted(self.sends.items()):
+                labels = f'type="{_escape(message_type)}"'
+                lines.append(f'quiz_channel_sends_total{{{labels}}} {count}')
+                lines.append(f'quiz_channel_send_bytes_total{{{labels}}} {size}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def track(kind, name, session_code=None):
+    """Замер одной обработки; имя можно уточнить через возвращаемую операцию"""
+    operation = Operation(kind, name, session_code)
+    sampled = SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE
+    token = _operation.set(operation if sampled else None)
+    started = time.perf_counter()
+    try:
+        yield operation
+    finally:
+        _operation.reset(token)
+        metrics.record(operation, time.perf_counter() - started, sampled)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """Обертка execute для всех соединений: запросы учитываются в текущей операции из выборки"""
+    operation = _operation.get()
+    if operation is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        operation.queries += 1
+        operation.query_time += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Время и запросы к БД для каждой view; подключается в settings.MIDDLEWARE"""
+
+    # Асинхронные view не переводятся из-за этого middleware в поток
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with track('view', 'unresolved') as operation:
+            response = self.get_response(request)
+            if request.resolver_match is not None:
+                operation.name = request.resolver_match.view_name
+        return response
+
+    async def __acall__(self, request):
+        with track('view', 'unresolved') as operation:
+            response = await self.get_response(request)
+            if request.resolver_match is not None:
+                operation.name = request.resolver_match.view_name
+        return response
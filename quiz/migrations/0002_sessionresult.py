@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionResult',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='result', serialize=False, to='quiz.quizsession', verbose_name='Сессия')),
+                ('participant_count', models.IntegerField(verbose_name='Участников')),
+                ('question_count', models.IntegerField(verbose_name='Вопросов')),
+                ('ranking', models.JSONField(verbose_name='Рейтинг')),
+                ('questions', models.JSONField(verbose_name='Статистика вопросов')),
+                ('computed_at', models.DateTimeField(auto_now_add=True, verbose_name='Вычислены')),
+            ],
+            options={
+                'verbose_name': 'Итоги сессии',
+                'verbose_name_plural': 'Итоги сессий',
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicate_orders(apps, schema_editor):
+    """Перед уникальным ограничением (quiz, order) вопросы викторин с повторами нумеруются заново"""
+    Question = apps.get_model('quiz', 'Question')
+    quiz_ids = Question.objects.values('quiz_id').annotate(
+        n=Count('id'), orders=Count('order', distinct=True)
+    ).exclude(n=models.F('orders')).values_list('quiz_id', flat=True)
+    for quiz_id in list(quiz_ids):
+        questions = list(Question.objects.filter(quiz_id=quiz_id).order_by('order', 'id'))
+        for order, question in enumerate(questions, 1):
+            question.order = order
+        Question.objects.bulk_update(questions, ['order'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0002_sessionresult'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='question',
+            constraint=models.UniqueConstraint(fields=('quiz', 'order'), name='quiz_question_quiz_order_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at', '-id'], name='quiz_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['creator', '-created_at'], name='quiz_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizsession',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['session_code'], name='quiz_session_active_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['session', '-score', 'id'], name='quiz_participant_rank_idx'),
+        ),
+    ]
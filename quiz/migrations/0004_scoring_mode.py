@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+def flat_points(apps, schema_editor):
+    """Ответы, данные до появления режимов подсчета, приносили одно очко за верный ответ"""
+    UserAnswer = apps.get_model('quiz', 'UserAnswer')
+    UserAnswer.objects.filter(is_correct=True).update(points=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='scoring_mode',
+            field=models.CharField(choices=[('flat', 'Очко за верный ответ'), ('speed', 'Бонус за скорость'), ('streak', 'Множитель серии')], default='flat', max_length=10, verbose_name='Подсчет очков'),
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='response_ms',
+            field=models.IntegerField(default=0, verbose_name='Суммарное время ответов (мс)'),
+        ),
+        migrations.AddField(
+            model_name='useranswer',
+            name='points',
+            field=models.IntegerField(default=0, verbose_name='Очки'),
+        ),
+        migrations.AddField(
+            model_name='useranswer',
+            name='response_ms',
+            field=models.IntegerField(default=0, verbose_name='Время ответа (мс)'),
+        ),
+        migrations.RunPython(flat_points, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='participant',
+            name='quiz_participant_rank_idx',
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['session', '-score', 'response_ms', 'id'], name='quiz_participant_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+import quiz.media
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0004_scoring_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина изображения'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота изображения'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='image_variants',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Варианты изображения'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='image',
+            field=models.ImageField(blank=True, height_field='image_height', null=True, upload_to=quiz.media.question_image_path, verbose_name='Изображение', width_field='image_width'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0005_question_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizsession',
+            name='question_order',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='Порядок вопросов'),
+        ),
+    ]
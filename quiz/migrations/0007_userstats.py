@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def build_stats(apps, schema_editor):
+    """Начальные итоги по уже завершенным сессиям и созданным викторинам"""
+    UserStats = apps.get_model('quiz', 'UserStats')
+    Participant = apps.get_model('quiz', 'Participant')
+    Quiz = apps.get_model('quiz', 'Quiz')
+
+    stats = {}
+    for row in Participant.objects.filter(user__isnull=False, session__result__isnull=False).values('user_id').annotate(
+        score=Sum('score'), sessions=Count('session', distinct=True)
+    ).order_by():
+        stats[row['user_id']] = UserStats(
+            user_id=row['user_id'], total_score=row['score'] or 0, total_quizzes_participated=row['sessions']
+        )
+    for row in Quiz.objects.values('creator_id').annotate(created=Count('id')).order_by():
+        item = stats.setdefault(row['creator_id'], UserStats(user_id=row['creator_id']))
+        item.total_quizzes_created = row['created']
+    UserStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0006_quizsession_question_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='quiz_stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('total_score', models.IntegerField(default=0, verbose_name='Всего очков')),
+                ('total_quizzes_participated', models.IntegerField(default=0, verbose_name='Сыграно викторин')),
+                ('total_quizzes_created', models.IntegerField(default=0, verbose_name='Создано викторин')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлены')),
+            ],
+            options={
+                'verbose_name': 'Статистика пользователя',
+                'verbose_name_plural': 'Статистика пользователей',
+                'indexes': [models.Index(fields=['-total_score', 'user'], name='quiz_userstats_rank_idx')],
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
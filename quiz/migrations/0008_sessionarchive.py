@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0007_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionArchive',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='quiz.quizsession', verbose_name='Сессия')),
+                ('participant_count', models.IntegerField(verbose_name='Участников')),
+                ('answer_count', models.IntegerField(verbose_name='Ответов')),
+                ('user_scores', models.JSONField(default=dict, verbose_name='Очки пользователей')),
+                ('data', models.BinaryField(verbose_name='Данные')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Архивирована')),
+            ],
+            options={
+                'verbose_name': 'Архив сессии',
+                'verbose_name_plural': 'Архивы сессий',
+            },
+        ),
+    ]
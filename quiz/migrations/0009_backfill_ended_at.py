@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_ended_at(apps, schema_editor):
+    """Сессии, завершенные до появления ended_at во всех путях: время последнего ответа или начала"""
+    QuizSession = apps.get_model('quiz', 'QuizSession')
+    UserAnswer = apps.get_model('quiz', 'UserAnswer')
+    last_answer = UserAnswer.objects.filter(participant__session=OuterRef('pk')).order_by().values(
+        'participant__session'
+    ).annotate(last=Max('answered_at')).values('last')[:1]
+    QuizSession.objects.filter(is_active=False, ended_at__isnull=True).update(
+        ended_at=Coalesce(Subquery(last_answer), F('started_at'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0008_sessionarchive'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ended_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0009_backfill_ended_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useranswer',
+            name='answered_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время ответа'),
+        ),
+    ]
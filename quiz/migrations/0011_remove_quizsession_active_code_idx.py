@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0010_useranswer_answered_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='quizsession',
+            name='quiz_session_active_code_idx',
+        ),
+    ]
@@ -1,9 +1,47 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
+from .media import question_image_path
+
+
+def count_subquery(queryset, field):
+    """Количество строк queryset, сгруппированных по field, как коррелированный подзапрос"""
+    return Coalesce(Subquery(
+        queryset.order_by().values(field).annotate(n=Count('pk')).values('n')[:1]
+    ), 0)
+
+
+class QuizQuerySet(models.QuerySet):
+    def with_stats(self, since=None):
+        """Викторины с автором и счетчиками вопросов, сессий и игроков без запроса на каждую строку"""
+        plays = Participant.objects.filter(session__quiz=OuterRef('pk'))
+        # Участники архивированных сессий учитываются по счетчику архива
+        archived_plays = Coalesce(Subquery(
+            SessionArchive.objects.filter(session__quiz=OuterRef('pk')).order_by().values('session__quiz').annotate(
+                n=Sum('participant_count')
+            ).values('n')[:1]
+        ), 0)
+        queryset = self.select_related('creator').annotate(
+            question_count=count_subquery(Question.objects.filter(quiz=OuterRef('pk')), 'quiz'),
+            session_count=count_subquery(QuizSession.objects.filter(quiz=OuterRef('pk')), 'quiz'),
+            play_count=count_subquery(plays, 'session__quiz') + archived_plays,
+        )
+        if since is not None:
+            queryset = queryset.annotate(
+                recent_play_count=count_subquery(plays.filter(joined_at__gte=since), 'session__quiz'),
+            )
+        return queryset
 
 
 class Quiz(models.Model):
+    SCORING_MODES = [
+        ('flat', 'Очко за верный ответ'),
+        ('speed', 'Бонус за скорость'),
+        ('streak', 'Множитель серии'),
+    ]
+    
     title = models.CharField(max_length=200, verbose_name="Название викторины")
     description = models.TextField(verbose_name="Описание")
     creator = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Создатель")
@@ -11,11 +49,20 @@ class Quiz(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="Активна")
     time_per_question = models.IntegerField(default=30, verbose_name="Время на вопрос (секунды)")
     code = models.CharField(max_length=10, unique=True, verbose_name="Код викторины")
+    scoring_mode = models.CharField(max_length=10, choices=SCORING_MODES, default='flat', verbose_name="Подсчет очков")
+    
+    objects = QuizQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Викторина"
         verbose_name_plural = "Викторины"
         ordering = ['-created_at']
+        indexes = [
+            # Каталог: активные викторины по дате с ключом (created_at, id)
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_active=True), name='quiz_active_created_idx'),
+            # Мои викторины
+            models.Index(fields=['creator', '-created_at'], name='quiz_creator_created_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -31,7 +78,14 @@ class Question(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions', verbose_name="Викторина")
     question_text = models.TextField(verbose_name="Текст вопроса")
     question_type = models.CharField(max_length=10, choices=QUESTION_TYPES, default='text', verbose_name="Тип вопроса")
-    image = models.ImageField(upload_to='questions/', blank=True, null=True, verbose_name="Изображение")
+    image = models.ImageField(
+        upload_to=question_image_path, width_field='image_width', height_field='image_height',
+        blank=True, null=True, verbose_name="Изображение"
+    )
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Ширина изображения")
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Высота изображения")
+    # {'source': имя оригинала, 'variants': [{'width', 'webp', 'jpeg'}]}, строится после загрузки
+    image_variants = models.JSONField(null=True, blank=True, editable=False, verbose_name="Варианты изображения")
     video_url = models.URLField(blank=True, null=True, verbose_name="URL видео")
     order = models.IntegerField(verbose_name="Порядок")
     
@@ -39,6 +93,10 @@ class Question(models.Model):
         verbose_name = "Вопрос"
         verbose_name_plural = "Вопросы"
         ordering = ['order']
+        constraints = [
+            # Вопросы викторины по порядку идут прямо по этому индексу
+            models.UniqueConstraint(fields=['quiz', 'order'], name='quiz_question_quiz_order_uniq'),
+        ]
     
     def __str__(self):
         return f"{self.quiz.title} - Вопрос {self.order}"
@@ -64,6 +122,8 @@ class QuizSession(models.Model):
     current_question = models.ForeignKey(Question, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Текущий вопрос")
     started_at = models.DateTimeField(auto_now_add=True, verbose_name="Начата")
     ended_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+    # Id вопросов в порядке показа, зафиксированном при запуске (перемешанный или неполный набор)
+    question_order = models.JSONField(null=True, blank=True, editable=False, verbose_name="Порядок вопросов")
     
     class Meta:
         verbose_name = "Сессия викторины"
@@ -78,12 +138,18 @@ class Participant(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Пользователь")
     nickname = models.CharField(max_length=100, verbose_name="Никнейм")
     score = models.IntegerField(default=0, verbose_name="Счет")
+    # Сумма времени ответов: при равном счете выше тот, кто отвечал быстрее
+    response_ms = models.IntegerField(default=0, verbose_name="Суммарное время ответов (мс)")
     joined_at = models.DateTimeField(auto_now_add=True, verbose_name="Присоединился")
     
     class Meta:
         verbose_name = "Участник"
         verbose_name_plural = "Участники"
         unique_together = ['session', 'nickname']
+        indexes = [
+            # Рейтинг сессии без сортировки всех участников
+            models.Index(fields=['session', '-score', 'response_ms', 'id'], name='quiz_participant_rank_idx'),
+        ]
     
     def __str__(self):
         return f"{self.nickname} - {self.session}"
@@ -93,8 +159,12 @@ class UserAnswer(models.Model):
     participant = models.ForeignKey(Participant, on_delete=models.CASCADE, verbose_name="Участник")
     question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name="Вопрос")
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, verbose_name="Ответ")
-    answered_at = models.DateTimeField(auto_now_add=True, verbose_name="Время ответа")
+    # Время принятия ответа сервером: ставится при приеме, а не при пакетной записи в БД
+    answered_at = models.DateTimeField(default=timezone.now, verbose_name="Время ответа")
     is_correct = models.BooleanField(verbose_name="Правильный ответ")
+    points = models.IntegerField(default=0, verbose_name="Очки")
+    # От открытия вопроса до получения ответа сервером
+    response_ms = models.IntegerField(default=0, verbose_name="Время ответа (мс)")
     
     class Meta:
         verbose_name = "Ответ пользователя"
@@ -105,3 +175,59 @@ class UserAnswer(models.Model):
         return f"{self.participant.nickname} - {self.question}"
 
 
+class SessionResult(models.Model):
+    """Итоги завершенной сессии, вычисленные один раз при ее завершении"""
+    session = models.OneToOneField(QuizSession, on_delete=models.CASCADE, primary_key=True, related_name='result', verbose_name="Сессия")
+    participant_count = models.IntegerField(verbose_name="Участников")
+    question_count = models.IntegerField(verbose_name="Вопросов")
+    # [{'id', 'nickname', 'username', 'score', 'rank'}] в порядке рейтинга
+    ranking = models.JSONField(verbose_name="Рейтинг")
+    # [{'id', 'order', 'text', 'correct', 'incorrect', 'mean_delay', 'answers': [{'id', 'answer_text', 'is_correct', 'count'}]}]
+    questions = models.JSONField(verbose_name="Статистика вопросов")
+    computed_at = models.DateTimeField(auto_now_add=True, verbose_name="Вычислены")
+    
+    class Meta:
+        verbose_name = "Итоги сессии"
+        verbose_name_plural = "Итоги сессий"
+    
+    def __str__(self):
+        return f"{self.session} - итоги"
+
+
+class UserStats(models.Model):
+    """Итоги пользователя по всем сессиям, пополняемые при завершении каждой сессии"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='quiz_stats', verbose_name="Пользователь")
+    total_score = models.IntegerField(default=0, verbose_name="Всего очков")
+    total_quizzes_participated = models.IntegerField(default=0, verbose_name="Сыграно викторин")
+    total_quizzes_created = models.IntegerField(default=0, verbose_name="Создано викторин")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлены")
+    
+    class Meta:
+        verbose_name = "Статистика пользователя"
+        verbose_name_plural = "Статистика пользователей"
+        indexes = [
+            # Общий рейтинг страницами по ключу (total_score, user_id)
+            models.Index(fields=['-total_score', 'user'], name='quiz_userstats_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} - {self.total_score}"
+
+
+class SessionArchive(models.Model):
+    """Участники и ответы давно завершенной сессии, перенесенные из рабочих таблиц одной сжатой записью"""
+    session = models.OneToOneField(QuizSession, on_delete=models.CASCADE, primary_key=True, related_name='archive', verbose_name="Сессия")
+    participant_count = models.IntegerField(verbose_name="Участников")
+    answer_count = models.IntegerField(verbose_name="Ответов")
+    # user_id -> очки за сессию: для пересчета статистики пользователей без распаковки data
+    user_scores = models.JSONField(default=dict, verbose_name="Очки пользователей")
+    # JSON Lines, сжатые zlib: строки участников ['p', ...] и ответов ['a', ...], см. quiz.archive
+    data = models.BinaryField(verbose_name="Данные")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Архивирована")
+    
+    class Meta:
+        verbose_name = "Архив сессии"
+        verbose_name_plural = "Архивы сессий"
+    
+    def __str__(self):
+        return f"{self.session_id} - архив"
@@ -0,0 +1,85 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # компактный протокол доступен только с установленным msgpack
+    msgpack = None
+
+JSON_SUBPROTOCOL = 'quiz.json'
+MSGPACK_SUBPROTOCOL = 'quiz.msgpack'
+
+# Короткие коды типов сообщений для компактного протокола (ключ 't' вместо 'type')
+MESSAGE_CODES = {
+    # клиент -> сервер
+    'join_quiz': 1,
+    'submit_answer': 2,
+    'start_quiz': 3,
+    'next_question': 4,  # и команда ведущего {'question_id': закрываемый вопрос}, и новый вопрос от сервера
+    'end_quiz': 5,
+    'resume': 6,  # {'since': номер последнего полученного события}
+    'watch_analytics': 7,  # только создатель викторины
+    # сервер -> клиент
+    'session_info': 10,
+    'answer_result': 11,
+    'room_delta': 12,
+    'leaderboard': 13,
+    'quiz_ended': 14,
+    'analytics': 15,
+}
+MESSAGE_TYPES = {code: message_type for message_type, code in MESSAGE_CODES.items()}
+
+
+def select_subprotocol(subprotocols):
+    """Выбор протокола из предложенных клиентом; None — JSON без подпротокола"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in subprotocols:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in subprotocols:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+class Serialized:
+    """Значение, сериализованное заранее в обоих форматах: в кадр вставляется без повторной сериализации"""
+
+    __slots__ = ('value', 'text', 'bytes')
+
+    def __init__(self, value):
+        self.value = value
+        self.text = json.dumps(value, ensure_ascii=False)
+        self.bytes = msgpack.packb(value) if msgpack is not None else None
+
+
+def encode(message_type, **fields):
+    """Кадр в обоих форматах; сериализуется один раз и отправляется всем сокетам как есть
+
+    Поля Serialized (данные вопросов из снимка викторины) вставляются в кадр готовыми.
+    """
+    ready = {key: value for key, value in fields.items() if isinstance(value, Serialized)}
+    plain = {key: value for key, value in fields.items() if key not in ready}
+    text = json.dumps({'type': message_type, **plain}, ensure_ascii=False)
+    if ready:
+        text = text[:-1] + ''.join(f', {json.dumps(key)}: {value.text}' for key, value in ready.items()) + '}'
+    frame = {'text': text}
+    if msgpack is not None:
+        plain = {'t': MESSAGE_CODES[message_type], **plain}
+        packer = msgpack.Packer()
+        frame['bytes'] = packer.pack_map_header(len(plain) + len(ready)) + b''.join(
+            packer.pack(key) + packer.pack(value) for key, value in plain.items()
+        ) + b''.join(packer.pack(key) + value.bytes for key, value in ready.items())
+    return frame
+
+
+def decode(text_data=None, bytes_data=None):
+    """Сообщение клиента в виде словаря с полем 'type'"""
+    if bytes_data is not None:
+        if msgpack is None:
+            raise ValueError('msgpack is not installed')
+        data = msgpack.unpackb(bytes_data)
+        data['type'] = MESSAGE_TYPES.get(data.pop('t', None))
+        return data
+    return json.loads(text_data)
+
+
+def group_event(message_type, fields, **extra):
+    """Событие для group_send: готовые кадры плюс поля, нужные обработчику в каждом воркере"""
+    return {'type': message_type, **extra, **encode(message_type, **fields)}
@@ -0,0 +1,83 @@
+from django.db import IntegrityError, transaction
+from .models import QuizSession, Participant, UserAnswer, SessionResult
+from .snapshot import get_snapshot
+from .stats import record_session
+
+
+def materialize_results(session_id):
+    """Итоги сессии: рейтинг и статистика по вопросам, вычисленные один раз и больше не меняющиеся"""
+    result = SessionResult.objects.filter(session_id=session_id).first()
+    if result is not None:
+        return result
+
+    quiz_id, question_order = QuizSession.objects.filter(id=session_id).values_list('quiz_id', 'question_order').get()
+    snapshot = get_snapshot(quiz_id)
+    # Вопросы в том порядке и составе, в котором их показывали в этой сессии
+    session_questions = snapshot.sequence(question_order).questions()
+
+    ranking = []
+    # user_id -> очки за сессию для общей статистики пользователей
+    user_scores = {}
+    for rank, participant in enumerate(Participant.objects.filter(session_id=session_id).order_by(
+        '-score', 'response_ms', 'id'
+    ).values('id', 'nickname', 'score', 'user_id', 'user__username'), 1):
+        if participant['user_id'] is not None:
+            user_scores[participant['user_id']] = user_scores.get(participant['user_id'], 0) + participant['score']
+        ranking.append({
+            'id': participant['id'],
+            'nickname': participant['nickname'],
+            'username': participant['user__username'],
+            'score': participant['score'],
+            'rank': rank,
+        })
+
+    # question_id -> {answer_id -> количество}, question_id -> время ответов от открытия вопроса (мс)
+    distribution = {question['id']: {} for question in session_questions}
+    delays = {question['id']: [] for question in session_questions}
+    for question_id, answer_id, response_ms in UserAnswer.objects.filter(
+        participant__session_id=session_id
+    ).values_list('question_id', 'answer_id', 'response_ms'):
+        if question_id in distribution:
+            distribution[question_id][answer_id] = distribution[question_id].get(answer_id, 0) + 1
+            delays[question_id].append(response_ms)
+
+    questions = []
+    for question in session_questions:
+        counts = distribution[question['id']]
+        answers = [
+            {
+                'id': answer['id'],
+                'answer_text': answer['answer_text'],
+                'is_correct': answer['is_correct'],
+                'count': counts.get(answer['id'], 0),
+            }
+            for answer in question['answers']
+        ]
+        correct = sum(answer['count'] for answer in answers if answer['is_correct'])
+        question_delays = delays[question['id']]
+        questions.append({
+            'id': question['id'],
+            'order': question['order'],
+            'text': question['text'],
+            'correct': correct,
+            'incorrect': sum(answer['count'] for answer in answers) - correct,
+            # Среднее время ответа в секундах от открытия вопроса
+            'mean_delay': sum(question_delays) / len(question_delays) / 1000 if question_delays else None,
+            'answers': answers,
+        })
+
+    try:
+        with transaction.atomic():
+            result = SessionResult.objects.create(
+                session_id=session_id,
+                participant_count=len(ranking),
+                question_count=len(session_questions),
+                ranking=ranking,
+                questions=questions,
+            )
+            # В той же транзакции: при гонке откатываются и итоги, и прибавка к статистике
+            record_session(user_scores)
+            return result
+    except IntegrityError:
+        # Итоги уже записал параллельный вызов
+        return SessionResult.objects.get(session_id=session_id)
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from functools import partial
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .answers import ANSWER_GRACE
+from .broadcast import send_to_room
+from .results import materialize_results
+from .store import run_store
+from .transitions import advance, persist_end, persist_transition
+
+LEADERBOARD_SIZE = getattr(settings, 'QUIZ_LEADERBOARD_SIZE', 10)
+
+# Все смены вопроса идут через этот модуль: дедлайн QuestionTimer, команда ведущего по WebSocket,
+# API next_question и ответ по HTTP в комнате без таймера. Каждая смена рассылается группе комнаты,
+# поэтому воркеры с сокетами комнаты подхватывают новый вопрос и его дедлайн, откуда бы он ни пришел.
+
+
+class QuestionTimer:
+    """Серверный дедлайн текущего вопроса комнаты и отложенное закрытие вопроса"""
+
+    def __init__(self):
+        self.index = None
+        # Время закрытия вопроса по time.time(), одинаковое для всех воркеров и клиентов;
+        # None — вопрос открыт без таймера (его закрывает ведущий или ответ по HTTP)
+        self.deadline = None
+        # Время открытия вопроса по time.time(): от него считается время ответа в любом воркере
+        self.opened = None
+        self._handle = None
+        self._tasks = set()
+
+    def open(self, index, opened, deadline, on_close):
+        """Открытие вопроса, открытого в opened, до deadline; повторное открытие ничего не меняет"""
+        if index == self.index and deadline == self.deadline:
+            return
+        self.cancel()
+        self.index = index
+        self.deadline = deadline
+        self.opened = opened
+        if deadline is not None:
+            self._handle = asyncio.get_running_loop().call_later(
+                max(0, deadline - time.time()), self._spawn, on_close, index
+            )
+
+    def _spawn(self, on_close, index):
+        self._handle = None
+        task = asyncio.ensure_future(on_close(index))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def is_open(self, index):
+        if index != self.index:
+            return False
+        return self.deadline is None or time.time() <= self.deadline + ANSWER_GRACE
+
+
+def time_left(timing, question_id):
+    """Секунды до дедлайна вопроса question_id по timing (question_id, открытие, дедлайн); None без дедлайна"""
+    if timing is None or timing[0] != question_id or timing[2] is None:
+        return None
+    return max(0, timing[2] - time.time())
+
+
+class Room:
+    """Комната, состояние которой не загружено в этом процессе (HTTP-запрос без сокетов комнаты)
+
+    Смена вопроса идет сравнением с обменом в общем хранилище и рассылается группе комнаты;
+    таймер вопроса запускают воркеры с сокетами комнаты, получив next_question.
+    """
+
+    timer = None
+
+    def __init__(self, session_id, session_code, store, snapshot=None, sequence=None):
+        self.session_id = session_id
+        self.session_code = session_code
+        self.store = store
+        # Снимок и порядок вопросов нужны для смены вопроса; кадрам изменений комнаты хватает хранилища
+        self.snapshot = snapshot
+        self.sequence = sequence
+
+
+async def open_question(room, index, timed=True):
+    """Открытие вопроса (с дедлайном из Quiz.time_per_question, если timed) и рассылка его комнате"""
+    opened = time.time()
+    deadline = opened + room.snapshot.time_per_question if timed else None
+    # Время открытия общее: по нему считается время ответа и там, где таймера этой комнаты нет (HTTP)
+    await run_store(
+        room.store, room.store.set_timing, room.session_id, room.snapshot.questions[index]['id'], opened, deadline
+    )
+    await _send_question(room, index, opened, deadline)
+
+
+async def _send_question(room, index, opened, deadline):
+    if room.timer is not None:
+        room.timer.open(index, opened, deadline, partial(close_question, room))
+    await send_to_room(room, 'next_question', {
+        'deadline': deadline,
+        'question': room.snapshot.serialized_payload(index),
+        # Изображение следующего вопроса загружается, пока идет этот, а не всеми сразу при его открытии
+        'prefetch': room.snapshot.prefetch(room.sequence.next_index(room.snapshot.questions[index]['id'])),
+    }, index=index, opened=opened, deadline=deadline)
+
+
+async def close_question(state, index):
+    """Закрытие вопроса index по дедлайну или команде ведущего: итоги вопроса и переход к следующему
+
+    Возвращает True, если вопрос сменил (или сессию завершил) этот вызов.
+    """
+    # Закрывается только текущий вопрос и один раз, даже если дедлайн и команда ведущего совпали;
+    # в общем хранилище переход идет сравнением с обменом от этого же вопроса
+    if index is None or index != state.current_index or state.closed_index == index or not state.is_active:
+        return False
+    # Следующий вопрос идет в том же режиме: с таймером или без него (комната, которую ведут по HTTP)
+    timed = state.timer.index == index and state.timer.deadline is not None
+    state.closed_index = index
+    state.timer.cancel()
+
+    await state.answers.flush()
+    await state.broadcast.flush()
+    # Живой рейтинг по итогам вопроса берется из рейтинга в памяти без сортировки
+    await send_to_room(state, 'leaderboard', {
+        'leaders': state.ranking(LEADERBOARD_SIZE),
+        'total': len(state.leaderboard)
+    })
+
+    if state.sequence.next_id(state.snapshot.questions[index]['id']) is None:
+        return await end_quiz(state)
+    next_index = await state.advance(index)
+    if next_index is not None:
+        await open_question(state, next_index, timed)
+        return True
+    # Вопрос уже сменили или сессию завершили в другом месте: комнате повторяется результат победителя
+    await announce_current(state)
+    return False
+
+
+async def announce_current(state):
+    """Рассылка текущего вопроса (или итогов) из общего хранилища после проигранного сравнения с обменом
+
+    Победитель тоже рассылает свой переход, поэтому повтор может дойти до клиентов дважды: повторный
+    next_question с тем же дедлайном ничего не меняет ни в таймерах воркеров, ни у клиентов.
+    """
+    store = state.store
+    if not await run_store(store, store.is_active, state.session_id):
+        state.is_active = False
+        state.timer.cancel()
+        await send_to_room(state, 'quiz_ended', {'results': state.ranking()})
+        return
+    question_id = await run_store(store, store.get_current, state.session_id)
+    index = state.snapshot.index_of.get(question_id)
+    if index is None:
+        return
+    timing = await run_store(store, store.get_timing, state.session_id)
+    if timing is not None and timing[0] == question_id:
+        _, opened, deadline = timing
+    else:
+        opened, deadline = time.time(), None
+    state.current_index = index
+    await _send_question(state, index, opened, deadline)
+
+
+async def end_quiz(state):
+    """Завершение викторины и рассылка итогового рейтинга (один раз на все воркеры)"""
+    state.timer.cancel()
+    await state.answers.flush()
+    await state.broadcast.flush()
+    results = await state.finish()
+    if results is None:
+        return False
+    await send_to_room(state, 'quiz_ended', {
+        'results': results
+    })
+    return True
+
+
+async def skip_question(room, question_id):
+    """Закрытие вопроса question_id из HTTP-запроса (API ведущего или ответ в комнате без таймера)
+
+    room — состояние комнаты, загруженное в этом процессе (тогда вопрос закрывает close_question),
+    или Room. Возвращает True, если вопрос сменил этот вызов.
+    """
+    if not isinstance(room, Room):
+        return await close_question(room, room.snapshot.index_of.get(question_id))
+
+    transition = await run_store(room.store, advance, room.store, room.sequence, room.session_id, question_id)
+    if transition is None:
+        return False
+    next_id, ended = transition
+    if ended:
+        await persist_end(room.store, room.sequence, room.session_id)
+        result = await database_sync_to_async(materialize_results)(room.session_id)
+        await send_to_room(room, 'quiz_ended', {'results': result.ranking})
+        return True
+    await database_sync_to_async(persist_transition)(room.session_id, next_id, False)
+    timing = await run_store(room.store, room.store.get_timing, room.session_id)
+    timed = timing is not None and timing[0] == question_id and timing[2] is not None
+    await open_question(room, room.snapshot.index_of[next_id], timed)
+    return True
@@ -0,0 +1,66 @@
+import logging
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .metrics import query_wrapper
+from .models import Quiz, Question, Answer
+from .catalog import invalidate_catalog
+from .media import build_variants
+from .snapshot import invalidate_quiz
+from .stats import quiz_created
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=Quiz)
+def quiz_changed(sender, instance, **kwargs):
+    invalidate_quiz(instance.id)
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Quiz)
+def quiz_saved_stats(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        quiz_created(instance.creator_id)
+
+
+@receiver(post_delete, sender=Quiz)
+def quiz_deleted_stats(sender, instance, **kwargs):
+    quiz_created(instance.creator_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    invalidate_quiz(instance.quiz_id)
+    # Количество вопросов показывается в каталоге
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Question)
+def question_image_saved(sender, instance, raw=False, **kwargs):
+    """Варианты нового изображения строятся при загрузке (форма и админка), а не при показе вопроса"""
+    if raw or not instance.image:
+        return
+    if instance.image_variants and instance.image_variants.get('source') == instance.image.name:
+        return
+    try:
+        instance.image_variants = build_variants(instance.image)
+    except Exception:
+        # Вопрос сохранен и показывается с оригиналом изображения, без уменьшенных копий
+        logger.exception('Не удалось построить варианты изображения %s', instance.image.name)
+        return
+    Question.objects.filter(id=instance.id).update(image_variants=instance.image_variants)
+    invalidate_quiz(instance.quiz_id)
+
+
+@receiver([post_save, post_delete], sender=Answer)
+def answer_changed(sender, instance, **kwargs):
+    quiz_id = Question.objects.filter(id=instance.question_id).values_list('quiz_id', flat=True).first()
+    if quiz_id:
+        invalidate_quiz(quiz_id)
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
@@ -0,0 +1,203 @@
+import json
+import random
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .media import image_sources
+from .models import Quiz
+from .protocol import Serialized
+
+SNAPSHOT_TIMEOUT = getattr(settings, 'QUIZ_SNAPSHOT_TIMEOUT', 60 * 60)
+# Сколько секунд версия викторины, проверенная в общем кэше, считается актуальной в этом процессе:
+# сотни подключений в начале сессии и каждый ответ по HTTP не обращаются к кэшу за версией
+SNAPSHOT_VERSION_TTL = getattr(settings, 'QUIZ_SNAPSHOT_VERSION_TTL', 1.0)
+
+# quiz_id -> скомпилированный снимок последней известной версии
+_snapshots = {}
+# quiz_id -> (версия, time.monotonic() проверки)
+_versions = {}
+
+
+class QuizSnapshot:
+    """Скомпилированная неизменяемая викторина: вопросы, ответы и готовые данные вопросов для клиентов"""
+
+    def __init__(self, quiz_id, version, title, time_per_question, questions, scoring_mode='flat'):
+        self.quiz_id = quiz_id
+        self.version = version
+        self.title = title
+        self.time_per_question = time_per_question
+        self.scoring_mode = scoring_mode
+        self.questions = tuple(questions)
+        self.index_of = {}
+        # answer_id -> (индекс вопроса, правильный ли ответ)
+        self.answer_index = {}
+        payloads = []
+        for index, question in enumerate(self.questions):
+            self.index_of[question['id']] = index
+            for answer in question['answers']:
+                self.answer_index[answer['id']] = (index, answer['is_correct'])
+            payloads.append({
+                'id': question['id'],
+                'text': question['text'],
+                'type': question['type'],
+                'image': question['image'],
+                'video_url': question['video_url'],
+                'answers': [{'id': a['id'], 'answer_text': a['answer_text']} for a in question['answers']],
+                'time_limit': time_per_question,
+            })
+        self.payloads = tuple(payloads)
+        # Те же данные, сериализованные один раз на версию: кадры вопросов для всех клиентов собираются из них
+        self.serialized = tuple(Serialized(payload) for payload in payloads)
+
+    @classmethod
+    def compile(cls, quiz_id, version):
+        """Сборка снимка из БД двумя запросами"""
+        quiz = Quiz.objects.only('id', 'title', 'time_per_question', 'scoring_mode').get(id=quiz_id)
+        questions = []
+        for question in quiz.questions.order_by('order').prefetch_related('answers'):
+            questions.append({
+                'id': question.id,
+                'order': question.order,
+                'text': question.question_text,
+                'type': question.question_type,
+                # {'src', 'srcset': {'webp', 'jpeg'}, 'width', 'height'} или None
+                'image': image_sources(
+                    question.image, question.image_variants, question.image_width, question.image_height
+                ),
+                'video_url': question.video_url,
+                'answers': [
+                    {'id': answer.id, 'answer_text': answer.answer_text, 'is_correct': answer.is_correct}
+                    for answer in question.answers.all()
+                ],
+            })
+        return cls(quiz.id, version, quiz.title, quiz.time_per_question, questions, quiz.scoring_mode)
+
+    def dumps(self):
+        return json.dumps({
+            'quiz_id': self.quiz_id,
+            'version': self.version,
+            'title': self.title,
+            'time_per_question': self.time_per_question,
+            'questions': self.questions,
+            'scoring_mode': self.scoring_mode,
+        }, ensure_ascii=False).encode()
+
+    @classmethod
+    def loads(cls, data):
+        return cls(**json.loads(data))
+
+    def question(self, question_id):
+        index = self.index_of.get(question_id)
+        return None if index is None else self.questions[index]
+
+    def payload(self, index):
+        """Данные вопроса для клиента (None, если вопроса нет)"""
+        if index is None or not 0 <= index < len(self.payloads):
+            return None
+        return self.payloads[index]
+
+    def serialized_payload(self, index):
+        """Данные вопроса для клиента, сериализованные заранее (None, если вопроса нет)"""
+        if index is None or not 0 <= index < len(self.serialized):
+            return None
+        return self.serialized[index]
+
+    def prefetch(self, index):
+        """Изображение вопроса index для предзагрузки клиентами заранее (None, если его нет)"""
+        payload = self.payload(index)
+        return payload['image'] if payload is not None else None
+
+    def sequence(self, question_ids=None):
+        """Порядок вопросов сессии (question_ids из QuizSession.question_order или все вопросы по order)"""
+        return SessionSequence(self, question_ids)
+
+
+class SessionSequence:
+    """Порядок вопросов одной сессии со следующим вопросом за O(1); вопросы, удаленные из викторины, пропускаются"""
+
+    def __init__(self, snapshot, question_ids=None):
+        self.snapshot = snapshot
+        if question_ids is None:
+            question_ids = [question['id'] for question in snapshot.questions]
+        self.question_ids = tuple(
+            question_id for question_id in dict.fromkeys(question_ids) if question_id in snapshot.index_of
+        )
+        # question_id -> id следующего вопроса; None -> первый вопрос
+        self._next = dict(zip((None,) + self.question_ids, self.question_ids + (None,)))
+        self.position_of = {question_id: position for position, question_id in enumerate(self.question_ids)}
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def first(self):
+        return self.question_ids[0] if self.question_ids else None
+
+    def next_id(self, question_id):
+        """Id вопроса, следующего за question_id (первого, если question_id пуст); None после последнего"""
+        return self._next.get(question_id)
+
+    def next_index(self, question_id):
+        """Индекс в снимке вопроса, следующего за question_id"""
+        return self.snapshot.index_of.get(self.next_id(question_id))
+
+    def questions(self):
+        return [self.snapshot.questions[self.snapshot.index_of[question_id]] for question_id in self.question_ids]
+
+
+def build_question_order(question_ids, shuffle=False, count=None):
+    """Порядок вопросов новой сессии: перемешанный и/или только первые count вопросов"""
+    question_ids = list(question_ids)
+    if shuffle:
+        random.shuffle(question_ids)
+    if count:
+        question_ids = question_ids[:count]
+    return question_ids
+
+
+def _version_key(quiz_id):
+    return f'quiz_snapshot_version:{quiz_id}'
+
+
+def _snapshot_key(quiz_id, version):
+    return f'quiz_snapshot:{quiz_id}:{version}'
+
+
+def get_version(quiz_id):
+    key = _version_key(quiz_id)
+    version = cache.get(key)
+    if version is None:
+        # Версия уникальна и после вытеснения ключа, чтобы не принять устаревший снимок
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_snapshot(quiz_id):
+    """Снимок викторины: из памяти процесса, из общего кэша или скомпилированный из БД"""
+    snapshot = _snapshots.get(quiz_id)
+    checked = _versions.get(quiz_id)
+    if snapshot is not None and checked is not None and checked[0] == snapshot.version \
+            and time.monotonic() - checked[1] < SNAPSHOT_VERSION_TTL:
+        return snapshot
+
+    version = get_version(quiz_id)
+    _versions[quiz_id] = (version, time.monotonic())
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    key = _snapshot_key(quiz_id, version)
+    data = cache.get(key)
+    if data is not None:
+        snapshot = QuizSnapshot.loads(data)
+    else:
+        snapshot = QuizSnapshot.compile(quiz_id, version)
+        cache.set(key, snapshot.dumps(), SNAPSHOT_TIMEOUT)
+    _snapshots[quiz_id] = snapshot
+    return snapshot
+
+
+def invalidate_quiz(quiz_id):
+    """Сброс снимка после изменения викторины, ее вопросов или ответов"""
+    cache.set(_version_key(quiz_id), time.time_ns(), timeout=None)
+    _snapshots.pop(quiz_id, None)
+    _versions.pop(quiz_id, None)
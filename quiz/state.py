@@ -0,0 +1,349 @@
+import asyncio
+import weakref
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Count
+from .analytics import RoomAnalytics
+from .answers import AnswerBuffer, accept_answer
+from .broadcast import RoomBroadcaster
+from .eventlog import EventLog
+from .leaderboard import Leaderboard
+from .scheduler import QuestionTimer
+from .models import QuizSession, Participant, UserAnswer
+from .protocol import encode
+from .snapshot import get_snapshot
+from .store import get_store, run_store
+from .transitions import advance, persist_end, persist_transition
+
+
+class SessionState:
+    """Живое состояние сессии викторины, загружаемое из БД один раз"""
+
+    def __init__(self, session_id, session_code, snapshot, current_index, is_active, store, sequence=None, creator_id=None):
+        self.session_id = session_id
+        self.session_code = session_code
+        # Создатель викторины — единственный, кому доступна живая аналитика
+        self.creator_id = creator_id
+        self.snapshot = snapshot
+        # Порядок вопросов этой сессии (перемешанный или неполный, если так выбрал ведущий)
+        self.sequence = sequence if sequence is not None else snapshot.sequence()
+        self.current_index = current_index
+        self.is_active = is_active
+        # Текущий вопрос, ответившие и счета общие для всех воркеров и хранятся в store
+        self.store = store
+        # participant_id -> {'id', 'nickname', 'score'}
+        self.participants = {}
+        self.leaderboard = Leaderboard()
+        # Принятые ответы, ожидающие пакетной записи в БД
+        self.answers = AnswerBuffer()
+        self.broadcast = RoomBroadcaster(self)
+        self.analytics = RoomAnalytics(self)
+        # Последние события комнаты для возобновления после переподключения
+        self.events = EventLog()
+        self.timer = QuestionTimer()
+        # Индекс последнего вопроса, итоги которого уже подведены
+        self.closed_index = None
+        self.connections = 0
+        # Номер изменения участников и счетов и кадр session_info, собранный при нем
+        self.revision = 0
+        self._session_info = None
+        self._unload = None
+        self._pending = set()
+
+    @classmethod
+    def load(cls, session_code):
+        """Загрузка сессии и участников; вопросы берутся из снимка викторины, счета — из общего хранилища"""
+        session = QuizSession.objects.filter(session_code=session_code).values(
+            'id', 'quiz_id', 'quiz__creator_id', 'current_question_id', 'is_active', 'question_order'
+        ).first()
+        if session is None:
+            return None
+
+        store = seed_store(session['id'], session['current_question_id'], session['is_active'])
+        snapshot = get_snapshot(session['quiz_id'])
+        state = cls(
+            session_id=session['id'],
+            session_code=session_code,
+            snapshot=snapshot,
+            current_index=snapshot.index_of.get(store.get_current(session['id'])),
+            is_active=store.is_active(session['id']),
+            store=store,
+            sequence=snapshot.sequence(session['question_order']),
+            creator_id=session['quiz__creator_id'],
+        )
+
+        scores = store.get_scores(state.session_id)
+        for participant in Participant.objects.filter(session_id=state.session_id).values(
+            'id', 'nickname', 'score', 'response_ms'
+        ):
+            score, time = scores.get(participant['id'], (participant['score'], participant['response_ms']))
+            state.add_participant(participant['id'], participant['nickname'], score, time)
+
+        # Счетчики аналитики читаются одним запросом при загрузке, дальше ведутся в памяти
+        state.analytics.seed(UserAnswer.objects.filter(participant__session_id=state.session_id).values(
+            'question_id', 'answer_id'
+        ).annotate(n=Count('id')).order_by().values_list('question_id', 'answer_id', 'n'))
+
+        return state
+
+    @property
+    def quiz_title(self):
+        return self.snapshot.title
+
+    @property
+    def current_question(self):
+        if self.current_index is None:
+            return None
+        return self.snapshot.questions[self.current_index]
+
+    def session_info(self):
+        """Кадр полного снимка комнаты; собирается заново, только если комната изменилась
+
+        Сотни клиентов, подключившихся к началу сессии, получают один и тот же кадр.
+        """
+        deadline = self.timer.deadline if self.timer.index == self.current_index else None
+        key = (self.revision, self.events.last_seq, self.current_index, deadline)
+        if self._session_info is None or self._session_info[0] != key:
+            self._session_info = (key, encode(
+                'session_info',
+                session_code=self.session_code,
+                quiz_title=self.quiz_title,
+                participants=self.participants_list(),
+                deadline=deadline,
+                current_question=self.snapshot.serialized_payload(self.current_index),
+                prefetch=self.snapshot.prefetch(self.next_index()) if self.current_index is not None else None,
+                seq=self.events.last_seq
+            ))
+        return self._session_info[1]
+
+    def next_index(self):
+        """Индекс в снимке вопроса, который откроется после текущего (None, если текущий последний)"""
+        current = self.current_question
+        return self.sequence.next_index(current['id'] if current else None)
+
+    def question_timing(self, index):
+        """(question_id, открытие, дедлайн) вопроса index по таймеру этого воркера; None — время в хранилище"""
+        if index is None or index != self.timer.index:
+            return None
+        return self.snapshot.questions[index]['id'], self.timer.opened, self.timer.deadline
+
+    def add_participant(self, participant_id, nickname, score=0, time=0):
+        participant = {'id': participant_id, 'nickname': nickname, 'score': score, 'time': time}
+        self.participants[participant_id] = participant
+        self.leaderboard.set_score(participant_id, score, time)
+        self.revision += 1
+        return participant
+
+    async def ensure_participant(self, participant_id):
+        """Участник комнаты; None, если в этой сессии такого участника нет
+
+        Присоединившийся после загрузки состояния (через HTTP или в другом воркере) подгружается из БД.
+        """
+        participant = self.participants.get(participant_id)
+        if participant is not None:
+            return participant
+        row = await database_sync_to_async(
+            Participant.objects.filter(id=participant_id, session_id=self.session_id).values(
+                'id', 'nickname', 'score', 'response_ms'
+            ).first
+        )()
+        if row is None:
+            return None
+        # Пока шел запрос, участника мог добавить кадр изменений комнаты
+        if participant_id in self.participants:
+            return self.participants[participant_id]
+        return self.add_participant(row['id'], row['nickname'], row['score'], row['response_ms'])
+
+    def participants_list(self):
+        return list(self.participants.values())
+
+    def set_score(self, participant_id, score, time=0):
+        """Новый счет и суммарное время ответов участника (мс), по которому разбиваются ничьи"""
+        participant = self.participants[participant_id]
+        participant['score'] = score
+        participant['time'] = time
+        self.leaderboard.set_score(participant_id, score, time)
+        self.revision += 1
+
+    def apply_delta(self, added, scores):
+        """Учет изменений комнаты, сделанных другими воркерами (повторное применение ничего не меняет)"""
+        for participant in added:
+            if participant['id'] not in self.participants:
+                self.add_participant(participant['id'], participant['nickname'], participant['score'], participant['time'])
+        for item in scores:
+            if item['id'] in self.participants:
+                self.set_score(item['id'], item['score'], item['time'])
+
+    def ranking(self, k=None):
+        """Первые k участников рейтинга с местами (все, если k не задано)"""
+        return [
+            dict(self.participants[participant_id], rank=rank)
+            for rank, (participant_id, _) in enumerate(self.leaderboard.top(k), 1)
+        ]
+
+    def neighbours(self, participant_id):
+        """Участники рядом с participant_id в рейтинге (по двое выше и ниже) с местами, без сортировки"""
+        return [
+            dict(self.participants[other_id], rank=rank)
+            for rank, other_id, _ in self.leaderboard.around(participant_id)
+        ]
+
+    async def submit_answer(self, participant_id, answer_id, received_at):
+        """Проверка и учет ответа, полученного в received_at по time.time(); None, если ответ не принят"""
+        if not self.is_active or participant_id not in self.participants:
+            return None
+        try:
+            question_index, is_correct = self.snapshot.answer_index[answer_id]
+        except KeyError:
+            return None
+        # Ответы только на текущий вопрос и только до дедлайна; опоздавшие отсекаются без обращения к БД
+        if question_index != self.current_index or not self.timer.is_open(question_index):
+            return None
+
+        question = self.snapshot.questions[question_index]
+        accepted = await run_store(
+            self.store, accept_answer, self.store, self.snapshot, self.session_id, participant_id, question_index,
+            is_correct, received_at, self.question_timing(question_index), self.sequence
+        )
+        if accepted is None:
+            return None
+
+        self.set_score(participant_id, accepted['score'], accepted['time'])
+        self.analytics.answer_added(question['id'], answer_id)
+        self.answers.add(
+            participant_id, question['id'], answer_id, is_correct, accepted['points'], accepted['response_ms']
+        )
+        return {
+            'question_id': question['id'],
+            'is_correct': is_correct,
+            'points': accepted['points'],
+            'score': accepted['score'],
+            'time': accepted['time'],
+            'rank': self.leaderboard.rank(participant_id),
+            'neighbours': self.neighbours(participant_id),
+        }
+
+    async def advance(self, index):
+        """Переход от вопроса index к следующему; None, если вопросы закончились или вопрос уже сменили"""
+        current_id = self.snapshot.questions[index]['id']
+        # После последнего вопроса сессию завершает finish, а не переход
+        if self.sequence.next_id(current_id) is None or not self.is_active:
+            return None
+
+        transition = await run_store(self.store, advance, self.store, self.sequence, self.session_id, current_id)
+        if transition is None:
+            # Вопрос уже сменили в другом воркере: берем общее состояние
+            current_id = await run_store(self.store, self.store.get_current, self.session_id)
+            self.current_index = self.snapshot.index_of.get(current_id)
+            return None
+
+        question_id, _ = transition
+        self.current_index = self.snapshot.index_of[question_id]
+        self.persist(persist_transition, self.session_id, question_id, False)
+        return self.current_index
+
+    async def finish(self):
+        """Завершение сессии; возвращает итоговый рейтинг или None, если сессию уже завершили"""
+        self.is_active = False
+        if not await run_store(self.store, self.store.finish, self.session_id):
+            return None
+        self._track(persist_end(self.store, self.sequence, self.session_id))
+        return self.ranking()
+
+    def persist(self, func, *args):
+        """Запись в БД в фоне, не задерживая обработку сообщений"""
+        self._track(database_sync_to_async(func)(*args))
+
+    def _track(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def drain(self):
+        """Ожидание завершения всех фоновых записей"""
+        await self.answers.flush()
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+
+def seed_store(session_id, current_question_id, is_active):
+    """Общее хранилище с состоянием сессии; при первом обращении заполняется из БД"""
+    store = get_store()
+    if store.is_seeded(session_id):
+        return store
+
+    scores = {
+        participant_id: (score, response_ms)
+        for participant_id, score, response_ms in Participant.objects.filter(
+            session_id=session_id
+        ).values_list('id', 'score', 'response_ms')
+    }
+    answered = {}
+    for participant_id, question_id in UserAnswer.objects.filter(
+        participant__session_id=session_id
+    ).values_list('participant_id', 'question_id'):
+        answered.setdefault(question_id, set()).add(participant_id)
+    store.seed(session_id, current_question_id, is_active, scores, answered)
+    return store
+
+
+# Сколько секунд состояние без подключений остается в памяти: при обрыве Wi-Fi
+# все переподключаются к тому же состоянию и журналу событий, без загрузки из БД
+STATE_LINGER = getattr(settings, 'QUIZ_STATE_LINGER', 60)
+
+_states = {}
+# Блокировка реестра для каждого цикла событий: asyncio.Lock привязывается к циклу, а тесты
+# и quiz_benchmark запускают в одном процессе несколько циклов по очереди
+_states_locks = weakref.WeakKeyDictionary()
+
+
+def _states_lock():
+    loop = asyncio.get_running_loop()
+    lock = _states_locks.get(loop)
+    if lock is None:
+        lock = _states_locks[loop] = asyncio.Lock()
+    return lock
+
+
+async def acquire_state(session_code):
+    """Получение состояния сессии из реестра процесса (с загрузкой при первом обращении)"""
+    async with _states_lock():
+        state = _states.get(session_code)
+        if state is None:
+            state = await database_sync_to_async(SessionState.load)(session_code)
+            if state is None:
+                return None
+            _states[session_code] = state
+        if state._unload is not None:
+            state._unload.cancel()
+            state._unload = None
+        state.connections += 1
+        return state
+
+
+async def release_state(state):
+    """Освобождение состояния; без подключений оно сбрасывается в БД и через STATE_LINGER выгружается"""
+    async with _states_lock():
+        state.connections -= 1
+        if state.connections > 0:
+            return
+    await state.drain()
+    async with _states_lock():
+        if state.connections == 0 and state._unload is None:
+            state._unload = asyncio.get_running_loop().call_later(
+                STATE_LINGER, lambda: asyncio.ensure_future(_unload_state(state))
+            )
+
+
+async def _unload_state(state):
+    async with _states_lock():
+        state._unload = None
+        if state.connections > 0:
+            return
+        state.timer.cancel()
+        await state.drain()
+        _states.pop(state.session_code, None)
+
+
+def get_loaded_state(session_code):
+    return _states.get(session_code)
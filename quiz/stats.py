@@ -0,0 +1,143 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import Quiz, Participant, SessionArchive, UserStats
+
+LEADERBOARD_PAGE_SIZE = getattr(settings, 'QUIZ_LEADERBOARD_PAGE_SIZE', 20)
+STATS_BATCH_SIZE = getattr(settings, 'QUIZ_STATS_BATCH_SIZE', 1000)
+
+
+def _ensure_stats(user_ids):
+    UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+
+
+def record_session(scores):
+    """Добавление итогов одной сессии (user_id -> очки) к статистике пользователей пакетом запросов
+
+    Вызывается в транзакции, создающей SessionResult: итоги сессии учитываются ровно один раз.
+    """
+    if not scores:
+        return
+    _ensure_stats(scores)
+    # Строки блокируются в порядке ключа, поэтому одновременно завершаемые сессии не взаимоблокируются
+    stats = list(UserStats.objects.select_for_update().filter(user_id__in=scores).order_by('user_id'))
+    # bulk_update не заполняет auto_now: время изменения ставится явно
+    now = timezone.now()
+    for item in stats:
+        item.total_score += scores[item.user_id]
+        item.total_quizzes_participated += 1
+        item.updated_at = now
+    UserStats.objects.bulk_update(
+        stats, ['total_score', 'total_quizzes_participated', 'updated_at'], batch_size=STATS_BATCH_SIZE
+    )
+
+
+def quiz_created(user_id, delta=1):
+    """Счетчик созданных викторин: +1 при создании, -1 при удалении"""
+    with transaction.atomic():
+        updated = UserStats.objects.filter(user_id=user_id).update(
+            total_quizzes_created=F('total_quizzes_created') + delta, updated_at=timezone.now()
+        )
+        # При удалении строка не создается: викторины удаляются и вместе с самим пользователем
+        if not updated and delta > 0:
+            _ensure_stats([user_id])
+            UserStats.objects.filter(user_id=user_id).update(
+                total_quizzes_created=F('total_quizzes_created') + delta, updated_at=timezone.now()
+            )
+
+
+def compute_stats():
+    """Итоги пользователей, заново вычисленные по завершенным сессиям и викторинам: user_id -> (очки, игры, викторины)"""
+    stats = {}
+    for row in Participant.objects.filter(user__isnull=False, session__result__isnull=False).values('user_id').annotate(
+        score=Sum('score'), sessions=Count('session', distinct=True)
+    ).order_by().iterator():
+        stats[row['user_id']] = (row['score'] or 0, row['sessions'], 0)
+    # Участники архивированных сессий уже не в Participant: их очки хранятся в самом архиве
+    for user_scores in SessionArchive.objects.values_list('user_scores', flat=True).iterator():
+        for user_id, score in user_scores.items():
+            total, sessions, _ = stats.get(int(user_id), (0, 0, 0))
+            stats[int(user_id)] = (total + score, sessions + 1, 0)
+    for row in Quiz.objects.values('creator_id').annotate(created=Count('id')).order_by().iterator():
+        score, sessions, _ = stats.get(row['creator_id'], (0, 0, 0))
+        stats[row['creator_id']] = (score, sessions, row['created'])
+    return stats
+
+
+def rebuild_stats(dry_run=False):
+    """Сверка статистики с полным пересчетом; возвращает user_id расхождений и без dry_run исправляет их"""
+    mismatched = []
+    with transaction.atomic():
+        # Сначала блокировка, потом пересчет: сессия, завершаемая параллельно, добавит свои очки после сверки
+        list(UserStats.objects.select_for_update().order_by('user_id').values_list('user_id', flat=True))
+        expected = compute_stats()
+        _ensure_stats(expected)
+        changed = []
+        now = timezone.now()
+        for item in UserStats.objects.order_by('user_id').iterator(chunk_size=STATS_BATCH_SIZE):
+            values = expected.get(item.user_id, (0, 0, 0))
+            if (item.total_score, item.total_quizzes_participated, item.total_quizzes_created) == values:
+                continue
+            mismatched.append(item.user_id)
+            item.total_score, item.total_quizzes_participated, item.total_quizzes_created = values
+            item.updated_at = now
+            changed.append(item)
+        if not dry_run:
+            UserStats.objects.bulk_update(
+                changed, ['total_score', 'total_quizzes_participated', 'total_quizzes_created', 'updated_at'],
+                batch_size=STATS_BATCH_SIZE
+            )
+        else:
+            transaction.set_rollback(True)
+    return mismatched
+
+
+class LeaderboardPage:
+    """Страница общего рейтинга по индексу (total_score, user_id) без OFFSET; курсор помнит место первой строки"""
+
+    def __init__(self, cursor=None, size=LEADERBOARD_PAGE_SIZE):
+        self.cursor = cursor
+        self.size = size
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Разбор курсора вида '<total_score>_<user_id>_<место>'; None для пустого или испорченного"""
+        parts = (cursor or '').split('_')
+        if len(parts) != 3:
+            return None
+        try:
+            return tuple(int(part) for part in parts)
+        except ValueError:
+            return None
+
+    @cached_property
+    def _rows(self):
+        queryset = UserStats.objects.select_related('user').filter(
+            Q(total_score__gt=0) | Q(total_quizzes_participated__gt=0)
+        ).order_by('-total_score', 'user_id')
+        position = self.parse_cursor(self.cursor)
+        if position is not None:
+            score, user_id, _ = position
+            queryset = queryset.filter(Q(total_score__lt=score) | Q(total_score=score, user_id__gt=user_id))
+        return list(queryset[:self.size + 1])
+
+    @property
+    def first_rank(self):
+        position = self.parse_cursor(self.cursor)
+        return position[2] + 1 if position is not None else 1
+
+    @property
+    def object_list(self):
+        items = self._rows[:self.size]
+        for rank, item in enumerate(items, self.first_rank):
+            item.rank = rank
+        return items
+
+    @property
+    def next_cursor(self):
+        if len(self._rows) <= self.size:
+            return None
+        last = self._rows[self.size - 1]
+        return f'{last.total_score}_{last.user_id}_{self.first_rank + self.size - 1}'
@@ -0,0 +1,324 @@
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# {'BACKEND': 'quiz.store.RedisSessionStore', 'OPTIONS': {'location': 'redis://localhost:6379/0'}}
+SESSION_STORE = getattr(settings, 'QUIZ_SESSION_STORE', {})
+SESSION_STORE_TIMEOUT = getattr(settings, 'QUIZ_SESSION_STORE_TIMEOUT', 24 * 60 * 60)
+
+
+class LocalSessionStore:
+    """Общее состояние сессий в памяти процесса: для одного воркера и тестов"""
+
+    # Операции только берут блокировку в памяти, поэтому вызываются прямо из цикла событий
+    blocking = False
+
+    def __init__(self, timeout=SESSION_STORE_TIMEOUT):
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        # session_id -> {'seeded', 'current', 'active', 'timing', 'scores', 'times', 'streaks', 'answered', 'seq'}
+        self._sessions = {}
+        # session_id -> время последнего обращения по time.monotonic()
+        self._touched = {}
+        self._purged = time.monotonic()
+
+    def _purge(self, now):
+        """Удаление сессий без обращений дольше timeout, как истечение ключей в Redis"""
+        self._purged = now
+        for session_id, touched in list(self._touched.items()):
+            if now - touched > self.timeout:
+                del self._touched[session_id]
+                self._sessions.pop(session_id, None)
+
+    def _session(self, session_id):
+        now = time.monotonic()
+        # Проверка сроков проходит по всем сессиям, поэтому не чаще раза за десятую часть timeout
+        if now - self._purged > self.timeout / 10:
+            self._purge(now)
+        self._touched[session_id] = now
+        return self._sessions.setdefault(session_id, {
+            'seeded': False,
+            'current': None,
+            'active': None,
+            'timing': None,
+            'scores': {},
+            'times': {},
+            'streaks': {},
+            'answered': {},
+            'seq': 0,
+        })
+
+    def is_seeded(self, session_id):
+        with self._lock:
+            return self._session(session_id)['seeded']
+
+    def seed(self, session_id, current_question_id, is_active, scores, answered):
+        """Заполнение из БД (scores: participant_id -> (счет, время ответов в мс)); записанное не перезаписывается"""
+        with self._lock:
+            session = self._session(session_id)
+            if session['active'] is None:
+                session['current'] = current_question_id
+                session['active'] = is_active
+            for participant_id, (score, response_ms) in scores.items():
+                session['scores'].setdefault(participant_id, score)
+                session['times'].setdefault(participant_id, response_ms)
+            for question_id, participant_ids in answered.items():
+                session['answered'].setdefault(question_id, set()).update(participant_ids)
+            session['seeded'] = True
+
+    def get_current(self, session_id):
+        with self._lock:
+            return self._session(session_id)['current']
+
+    def advance(self, session_id, expected_question_id, question_id):
+        """Смена текущего вопроса, только если текущим остается expected_question_id"""
+        with self._lock:
+            session = self._session(session_id)
+            if session['current'] != expected_question_id:
+                return False
+            session['current'] = question_id
+            return True
+
+    def set_timing(self, session_id, question_id, opened, deadline):
+        """Время открытия и дедлайн (по time.time(), дедлайн может быть None) открытого вопроса"""
+        with self._lock:
+            self._session(session_id)['timing'] = (question_id, opened, deadline)
+
+    def get_timing(self, session_id):
+        """(question_id, открытие, дедлайн) последнего открытого вопроса или None"""
+        with self._lock:
+            return self._session(session_id)['timing']
+
+    def is_active(self, session_id):
+        with self._lock:
+            return bool(self._session(session_id)['active'])
+
+    def finish(self, session_id):
+        """Завершение сессии; True только для вызова, который ее завершил"""
+        with self._lock:
+            session = self._session(session_id)
+            was_active = session['active']
+            session['active'] = False
+            return bool(was_active)
+
+    def mark_answered(self, session_id, question_id, participant_id):
+        """Отметка ответа; False, если участник уже отвечал на вопрос"""
+        with self._lock:
+            answered = self._session(session_id)['answered'].setdefault(question_id, set())
+            if participant_id in answered:
+                return False
+            answered.add(participant_id)
+            return True
+
+    def count_answered(self, session_id, question_ids):
+        """Сколько ответов на вопросы question_ids принято всеми воркерами"""
+        with self._lock:
+            answered = self._session(session_id)['answered']
+            return sum(len(answered.get(question_id, ())) for question_id in question_ids)
+
+    def add_score(self, session_id, participant_id, points, response_ms=0):
+        """Начисление очков и времени ответа; возвращает новые (счет, время ответов в мс)"""
+        with self._lock:
+            session = self._session(session_id)
+            scores, times = session['scores'], session['times']
+            scores[participant_id] = scores.get(participant_id, 0) + points
+            times[participant_id] = times.get(participant_id, 0) + response_ms
+            return scores[participant_id], times[participant_id]
+
+    def get_scores(self, session_id):
+        """participant_id -> (счет, время ответов в мс)"""
+        with self._lock:
+            session = self._session(session_id)
+            return {
+                participant_id: (score, session['times'].get(participant_id, 0))
+                for participant_id, score in session['scores'].items()
+            }
+
+    def next_streak(self, session_id, participant_id, index, is_correct):
+        """Длина серии верных ответов участника после ответа на вопрос index (пропуск вопроса рвет серию)"""
+        with self._lock:
+            streaks = self._session(session_id)['streaks']
+            last_index, streak = streaks.get(participant_id, (None, 0))
+            streak = (streak + 1 if last_index == index - 1 else 1) if is_correct else 0
+            streaks[participant_id] = (index, streak)
+            return streak
+
+    def next_seq(self, session_id):
+        """Следующий номер события комнаты"""
+        with self._lock:
+            session = self._session(session_id)
+            session['seq'] += 1
+            return session['seq']
+
+
+class RedisSessionStore:
+    """Общее состояние сессий в Redis (или совместимом сервере) для нескольких воркеров"""
+
+    # Каждая операция атомарна на сервере: множества ответивших (SADD), счета в хэше (HINCRBY),
+    # смена вопроса через WATCH/MULTI. Клиент синхронный: из асинхронного кода операции вызываются
+    # через run_store в потоке. Ответы разбираются одинаково при decode_responses=True и без него.
+
+    blocking = True
+
+    def __init__(self, location=None, client=None, prefix='quiz', timeout=SESSION_STORE_TIMEOUT):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(location)
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _key(self, session_id, *parts):
+        return ':'.join([self.prefix, 'session', str(session_id), *map(str, parts)])
+
+    def is_seeded(self, session_id):
+        return bool(self.client.exists(self._key(session_id, 'seeded')))
+
+    def seed(self, session_id, current_question_id, is_active, scores, answered):
+        """Заполнение из БД (scores: participant_id -> (счет, время ответов в мс)); записанное не перезаписывается"""
+        pipe = self.client.pipeline()
+        pipe.set(self._key(session_id, 'current'), current_question_id or 0, nx=True, ex=self.timeout)
+        pipe.set(self._key(session_id, 'active'), int(bool(is_active)), nx=True, ex=self.timeout)
+        scores_key = self._key(session_id, 'scores')
+        times_key = self._key(session_id, 'times')
+        for participant_id, (score, response_ms) in scores.items():
+            pipe.hsetnx(scores_key, participant_id, score)
+            pipe.hsetnx(times_key, participant_id, response_ms)
+        pipe.expire(scores_key, self.timeout)
+        pipe.expire(times_key, self.timeout)
+        for question_id, participant_ids in answered.items():
+            if participant_ids:
+                answered_key = self._key(session_id, 'answered', question_id)
+                pipe.sadd(answered_key, *participant_ids)
+                pipe.expire(answered_key, self.timeout)
+        pipe.set(self._key(session_id, 'seeded'), 1, ex=self.timeout)
+        pipe.execute()
+
+    def get_current(self, session_id):
+        return _int(self.client.get(self._key(session_id, 'current'))) or None
+
+    def advance(self, session_id, expected_question_id, question_id):
+        """Смена текущего вопроса, только если текущим остается expected_question_id"""
+        key = self._key(session_id, 'current')
+
+        def swap(pipe):
+            if (_int(pipe.get(key)) or None) != expected_question_id:
+                return False
+            pipe.multi()
+            pipe.set(key, question_id or 0, ex=self.timeout)
+            return True
+
+        return self.client.transaction(swap, key, value_from_callable=True)
+
+    def set_timing(self, session_id, question_id, opened, deadline):
+        """Время открытия и дедлайн (по time.time(), дедлайн может быть None) открытого вопроса"""
+        value = f'{question_id}:{opened!r}:{"" if deadline is None else repr(deadline)}'
+        self.client.set(self._key(session_id, 'timing'), value, ex=self.timeout)
+
+    def get_timing(self, session_id):
+        """(question_id, открытие, дедлайн) последнего открытого вопроса или None"""
+        value = self.client.get(self._key(session_id, 'timing'))
+        if not value:
+            return None
+        question_id, opened, deadline = _text(value).split(':')
+        return int(question_id), float(opened), float(deadline) if deadline else None
+
+    def is_active(self, session_id):
+        return _int(self.client.get(self._key(session_id, 'active'))) == 1
+
+    def finish(self, session_id):
+        """Завершение сессии; True только для вызова, который ее завершил"""
+        return _int(self.client.getset(self._key(session_id, 'active'), 0)) == 1
+
+    def mark_answered(self, session_id, question_id, participant_id):
+        """Отметка ответа; False, если участник уже отвечал на вопрос"""
+        key = self._key(session_id, 'answered', question_id)
+        pipe = self.client.pipeline()
+        pipe.sadd(key, participant_id)
+        pipe.expire(key, self.timeout)
+        added, _ = pipe.execute()
+        return added == 1
+
+    def count_answered(self, session_id, question_ids):
+        """Сколько ответов на вопросы question_ids принято всеми воркерами"""
+        pipe = self.client.pipeline()
+        for question_id in question_ids:
+            pipe.scard(self._key(session_id, 'answered', question_id))
+        return sum(map(_int, pipe.execute()))
+
+    def add_score(self, session_id, participant_id, points, response_ms=0):
+        """Начисление очков и времени ответа; возвращает новые (счет, время ответов в мс)"""
+        pipe = self.client.pipeline()
+        pipe.hincrby(self._key(session_id, 'scores'), participant_id, points)
+        pipe.hincrby(self._key(session_id, 'times'), participant_id, response_ms)
+        score, response_ms = pipe.execute()
+        return score, response_ms
+
+    def get_scores(self, session_id):
+        """participant_id -> (счет, время ответов в мс)"""
+        pipe = self.client.pipeline()
+        pipe.hgetall(self._key(session_id, 'scores'))
+        pipe.hgetall(self._key(session_id, 'times'))
+        scores, times = pipe.execute()
+        return {
+            int(participant_id): (int(score), _int(times.get(participant_id)))
+            for participant_id, score in scores.items()
+        }
+
+    def next_streak(self, session_id, participant_id, index, is_correct):
+        """Длина серии верных ответов участника после ответа на вопрос index (пропуск вопроса рвет серию)"""
+        # Участник отвечает на вопрос один раз (mark_answered), поэтому чтение и запись не пересекаются
+        key = self._key(session_id, 'streaks')
+        last_index, _, streak = _text(self.client.hget(key, participant_id) or '-2:0').partition(':')
+        streak = (int(streak) + 1 if int(last_index) == index - 1 else 1) if is_correct else 0
+        pipe = self.client.pipeline()
+        pipe.hset(key, participant_id, f'{index}:{streak}')
+        pipe.expire(key, self.timeout)
+        pipe.execute()
+        return streak
+
+    def next_seq(self, session_id):
+        """Следующий номер события комнаты"""
+        key = self._key(session_id, 'seq')
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, self.timeout)
+        seq, _ = pipe.execute()
+        return int(seq)
+
+
+def _int(value):
+    """Число из ответа Redis: bytes, str (decode_responses=True) или None"""
+    return int(value or 0)
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def run_store(store, func, *args):
+    """Вызов func(*args), обращающейся к хранилищу store, из асинхронного кода
+
+    Операции сетевого хранилища (store.blocking) выполняются в пуле потоков и не останавливают
+    цикл событий; func может делать несколько обращений к хранилищу за один переход в поток.
+    """
+    if store.blocking:
+        return await sync_to_async(func, thread_sensitive=False)(*args)
+    return func(*args)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Хранилище состояния сессий, настроенное в QUIZ_SESSION_STORE (по умолчанию в памяти процесса)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = import_string(SESSION_STORE.get('BACKEND', 'quiz.store.LocalSessionStore'))
+                _store = backend(**SESSION_STORE.get('OPTIONS', {}))
+    return _store
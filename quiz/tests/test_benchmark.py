@@ -0,0 +1,67 @@
+import importlib.util
+import io
+from unittest import skipUnless
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from quiz.leaderboard import Leaderboard
+from quiz.management.commands.quiz_benchmark import Command
+from quiz.protocol import encode
+from quiz.snapshot import QuizSnapshot
+from quiz.state import _states
+
+# Замеры идут через фикстуру benchmark из pytest-benchmark: pytest quiz/tests/test_benchmark.py.
+# Без плагина (и под manage.py test) тесты пропускаются.
+HAS_BENCHMARK = importlib.util.find_spec('pytest_benchmark') is not None
+if HAS_BENCHMARK:
+    import pytest
+
+PLAYERS = 1000
+
+
+@skipUnless(HAS_BENCHMARK, 'нужен pytest-benchmark')
+class BenchmarkTests(TransactionTestCase):
+    benchmark = None
+
+    if HAS_BENCHMARK:
+        @pytest.fixture(autouse=True)
+        def _benchmark(self, benchmark):
+            self.benchmark = benchmark
+
+    def setUp(self):
+        if self.benchmark is None:
+            self.skipTest('замеры запускаются через pytest')
+
+    def test_leaderboard_answer_burst(self):
+        """Наплыв ответов у дедлайна: каждый из PLAYERS участников меняет счет, затем берутся первые места"""
+        def burst():
+            board = Leaderboard({participant_id: (0, 0) for participant_id in range(PLAYERS)})
+            for participant_id in range(PLAYERS):
+                board.set_score(participant_id, participant_id % 37, participant_id)
+            return board.top(10)
+
+        top = self.benchmark(burst)
+        self.assertEqual(len(top), 10)
+
+    def test_next_question_frame(self):
+        """Кадр next_question собирается из данных вопроса, сериализованных в снимке заранее"""
+        snapshot = QuizSnapshot(1, 1, 'Quiz', 30, [{
+            'id': 1, 'text': 'Вопрос ' * 20, 'type': 'text', 'image': None, 'video_url': None,
+            'answers': [{'id': n, 'answer_text': f'Ответ {n}', 'is_correct': n == 0} for n in range(4)],
+        }])
+        frame = self.benchmark(
+            encode, 'next_question', deadline=None, question=snapshot.serialized_payload(0), prefetch=None, seq=1
+        )
+        self.assertIn('"question": {"id": 1', frame['text'])
+
+    def test_game_round(self):
+        """Полная игра через ASGI в процессе: присоединение, ответы всех игроков на каждый вопрос, итоги"""
+        command = Command(stdout=io.StringIO())
+
+        def play():
+            call_command(command, players=40, questions=3, timeout=10)
+            _states.clear()
+
+        self.benchmark.pedantic(play, rounds=3, iterations=1)
+        self.assertEqual(len(command.stats['answer']), 40 * 3)
+        # Ответы пишутся пакетами: запросов к БД на вопрос (вместе с итогами после последнего) меньше, чем игроков
+        self.assertLess(max(command.stats['queries']), 40)
@@ -0,0 +1,55 @@
+from unittest import skipUnless
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+from quiz.models import Quiz, Question, Participant, UserAnswer, UserStats
+
+
+@skipUnless(connection.vendor == 'sqlite', 'план запроса проверяется по EXPLAIN QUERY PLAN SQLite')
+class HotQueryIndexTests(TestCase):
+    """Горячие запросы идут по индексам, а не просмотром всей таблицы и не сортировкой во временном B-дереве"""
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'USING (COVERING )?INDEX', plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+        if index is not None:
+            self.assertIn(index, plan)
+
+    def test_participant_by_nickname(self):
+        self.assertUsesIndex(Participant.objects.filter(session_id=1, nickname='player'))
+
+    def test_answer_by_participant_and_question(self):
+        self.assertUsesIndex(UserAnswer.objects.filter(participant_id=1, question_id=1))
+
+    def test_quiz_questions_in_order(self):
+        self.assertUsesIndex(Question.objects.filter(quiz_id=1).order_by('order'))
+
+    def test_catalog_keyset(self):
+        self.assertUsesIndex(
+            Quiz.objects.filter(is_active=True).order_by('-created_at', '-id'), 'quiz_active_created_idx'
+        )
+
+    def test_my_quizzes(self):
+        self.assertUsesIndex(Quiz.objects.filter(creator_id=1).order_by('-created_at'), 'quiz_creator_created_idx')
+
+    def test_session_ranking(self):
+        self.assertUsesIndex(
+            Participant.objects.filter(session_id=1).order_by('-score', 'response_ms', 'id'),
+            'quiz_participant_rank_idx'
+        )
+
+    def test_global_leaderboard(self):
+        self.assertUsesIndex(UserStats.objects.order_by('-total_score', 'user_id'), 'quiz_userstats_rank_idx')
+
+
+class QuestionOrderConstraintTests(TestCase):
+    def test_order_is_unique_per_quiz(self):
+        user = User.objects.create(username='host')
+        quiz = Quiz.objects.create(title='Q', description='', creator=user, code='Q1')
+        other = Quiz.objects.create(title='Q', description='', creator=user, code='Q2')
+        Question.objects.create(quiz=quiz, question_text='first', order=1)
+        # Тот же порядок в другой викторине допустим
+        Question.objects.create(quiz=other, question_text='first', order=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Question.objects.create(quiz=quiz, question_text='second', order=1)
@@ -0,0 +1,58 @@
+from django.test import SimpleTestCase
+from quiz.leaderboard import Leaderboard
+
+
+class LeaderboardTests(SimpleTestCase):
+    def setUp(self):
+        # participant_id -> (счет, суммарное время ответов в мс)
+        self.board = Leaderboard({1: (10, 500), 2: (30, 900), 3: (20, 100), 4: (20, 50)})
+
+    def test_top_orders_by_score_then_time(self):
+        self.assertEqual(self.board.top(), [(2, 30), (4, 20), (3, 20), (1, 10)])
+        self.assertEqual(self.board.top(2), [(2, 30), (4, 20)])
+
+    def test_tie_on_score_and_time_goes_to_earlier_participant(self):
+        board = Leaderboard({7: (5, 100), 3: (5, 100)})
+        self.assertEqual(board.top(), [(3, 5), (7, 5)])
+
+    def test_rank(self):
+        self.assertEqual([self.board.rank(pid) for pid in (2, 4, 3, 1)], [1, 2, 3, 4])
+        self.assertIsNone(self.board.rank(99))
+
+    def test_set_score_moves_participant(self):
+        self.board.set_score(1, 40, 700)
+        self.assertEqual(self.board.rank(1), 1)
+        self.assertEqual(self.board.score(1), 40)
+        self.assertEqual(self.board.top(2), [(1, 40), (2, 30)])
+        # Повтор того же счета ничего не меняет
+        self.board.set_score(1, 40, 700)
+        self.assertEqual(len(self.board), 4)
+
+    def test_new_participant_and_remove(self):
+        self.board.set_score(5, 0)
+        self.assertIn(5, self.board)
+        self.assertEqual(self.board.rank(5), 5)
+        self.board.remove(5)
+        self.assertNotIn(5, self.board)
+        self.assertEqual(len(self.board), 4)
+        # Удаление отсутствующего участника не ошибка
+        self.board.remove(5)
+
+    def test_around(self):
+        board = Leaderboard({pid: (pid * 10, 0) for pid in range(1, 8)})
+        self.assertEqual(board.around(4), [(2, 6, 60), (3, 5, 50), (4, 4, 40), (5, 3, 30), (6, 2, 20)])
+        # У краев рейтинга соседей меньше
+        self.assertEqual(board.around(7, radius=1), [(1, 7, 70), (2, 6, 60)])
+        self.assertEqual(board.around(1, radius=1), [(6, 2, 20), (7, 1, 10)])
+        self.assertEqual(board.around(99), [])
+
+    def test_matches_full_sort_after_many_updates(self):
+        board = Leaderboard()
+        scores = {}
+        for step in range(200):
+            participant_id = step * 7 % 23
+            scores[participant_id] = (step * 13 % 50, step % 5)
+            board.set_score(participant_id, *scores[participant_id])
+        expected = sorted(scores, key=lambda pid: (-scores[pid][0], scores[pid][1], pid))
+        self.assertEqual([pid for pid, _ in board.top()], expected)
+        self.assertEqual([board.rank(pid) for pid in expected], list(range(1, len(expected) + 1)))
@@ -0,0 +1,86 @@
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from quiz import transfer
+from quiz.models import Quiz, Question
+
+try:
+    from PIL import Image
+except ImportError:  # изображения проверяются только с установленным Pillow
+    Image = None
+
+
+def jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def archive(images):
+    row = {'text': 'Вопрос', 'image': 'p.jpg', 'answers': [{'text': 'a', 'correct': True}, {'text': 'b'}]}
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as result:
+        result.writestr('questions.jsonl', '{"text": "Без картинки", "answers": [{"text": "a", "correct": true}, '
+                                           '{"text": "b"}]}\n' + json.dumps(row) + '\n')
+        for name, data in images.items():
+            result.writestr(name, data)
+    return SimpleUploadedFile('quiz.zip', buffer.getvalue())
+
+
+class ImportImageTests(TestCase):
+    def setUp(self):
+        if Image is None:
+            self.skipTest('Pillow не установлен')
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        user = User.objects.create(username='host')
+        self.quiz = Quiz.objects.create(title='Quiz', description='', creator=user, code='IMP1')
+
+    def test_corrupt_image_rolls_back_with_line_number(self):
+        with self.assertRaises(transfer.QuizImportError) as raised:
+            transfer.import_questions(self.quiz, archive({'p.jpg': b'not an image'}))
+        self.assertEqual(len(raised.exception.errors), 1)
+        self.assertTrue(raised.exception.errors[0].startswith('строка 2:'))
+        self.assertFalse(Question.objects.filter(quiz=self.quiz).exists())
+
+    def test_variant_failure_keeps_imported_question(self):
+        with mock.patch.object(transfer, 'build_variants', side_effect=OSError), \
+                self.assertLogs('quiz.transfer', 'ERROR'):
+            imported = transfer.import_questions(self.quiz, archive({'p.jpg': jpeg()}))
+        self.assertEqual(imported, 2)
+        question = Question.objects.get(quiz=self.quiz, question_text='Вопрос')
+        self.assertTrue(question.image)
+        self.assertIsNone(question.image_variants)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='host')
+        self.quiz = Quiz.objects.create(title='Quiz', description='', creator=self.user, code='EXP1')
+        for order in range(1, 4):
+            question = Question.objects.create(quiz=self.quiz, question_text=f'q{order}', order=order)
+            question.answers.create(answer_text='yes', is_correct=True)
+        self.client.force_login(self.user)
+
+    def test_wsgi_export_streams_sync_iterator(self):
+        response = self.client.get(f'/quiz/{self.quiz.id}/export/')
+        self.assertFalse(response.is_async)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['text'] for row in rows], ['q1', 'q2', 'q3'])
+
+    async def test_asgi_export_streams_async_iterator(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(f'/quiz/{self.quiz.id}/export/', {'format': 'csv'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual([line.split(',')[0] for line in content.splitlines()[1:]], ['q1', 'q2', 'q3'])
@@ -0,0 +1,195 @@
+import json
+import threading
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from quiz.answers import accept_answer
+from quiz.consumers import QuizConsumer
+from quiz.models import Quiz, Question, Answer, QuizSession, Participant
+from quiz.snapshot import QuizSnapshot
+from quiz.state import _states
+from quiz.store import LocalSessionStore, RedisSessionStore
+from quiz.transitions import advance
+
+try:
+    import fakeredis
+except ImportError:  # хранилище Redis проверяется только с установленным fakeredis
+    fakeredis = None
+
+
+def make_snapshot(question_ids):
+    questions = [
+        {'id': question_id, 'text': f'q{question_id}', 'type': 'text', 'image': None, 'video_url': None, 'answers': []}
+        for question_id in question_ids
+    ]
+    return QuizSnapshot(1, 1, 'Quiz', 30, questions)
+
+
+def make_sequence(question_ids):
+    return make_snapshot(question_ids).sequence()
+
+
+class LocalStoreTransitionTests(SimpleTestCase):
+    """Смена вопроса сравнением с обменом: повторная команда от того же вопроса ничего не сдвигает"""
+
+    session_id = 1
+
+    def make_store(self):
+        return LocalSessionStore()
+
+    def setUp(self):
+        self.store = self.make_store()
+        self.sequence = make_sequence([11, 12, 13])
+        self.store.seed(self.session_id, 11, True, {}, {})
+
+    def test_advance_moves_once(self):
+        self.assertEqual(advance(self.store, self.sequence, self.session_id, 11), (12, False))
+        # Двойное нажатие или повторный POST относится к уже закрытому вопросу
+        self.assertIsNone(advance(self.store, self.sequence, self.session_id, 11))
+        self.assertEqual(self.store.get_current(self.session_id), 12)
+
+    def test_concurrent_advances_move_once(self):
+        results = []
+        barrier = threading.Barrier(8)
+
+        def worker():
+            barrier.wait()
+            results.append(advance(self.store, self.sequence, self.session_id, 11))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([result for result in results if result is not None], [(12, False)])
+        self.assertEqual(self.store.get_current(self.session_id), 12)
+
+    def test_last_question_finishes_once(self):
+        advance(self.store, self.sequence, self.session_id, 11)
+        # Устаревшая команда для последнего вопроса, пока он еще не открыт, сессию не завершает
+        self.assertIsNone(advance(self.store, self.sequence, self.session_id, 13))
+        self.assertTrue(self.store.is_active(self.session_id))
+
+        advance(self.store, self.sequence, self.session_id, 12)
+        self.assertEqual(advance(self.store, self.sequence, self.session_id, 13), (None, True))
+        self.assertIsNone(advance(self.store, self.sequence, self.session_id, 13))
+        self.assertFalse(self.store.is_active(self.session_id))
+
+
+class RedisStoreTransitionTests(LocalStoreTransitionTests):
+    def make_store(self):
+        if fakeredis is None:
+            self.skipTest('fakeredis не установлен')
+        return RedisSessionStore(client=fakeredis.FakeRedis(), prefix=self.id())
+
+
+class AcceptAnswerTests(SimpleTestCase):
+    """Без таймера ответ принимается только на текущий вопрос, входящий в порядок сессии"""
+
+    def setUp(self):
+        self.store = LocalSessionStore()
+        self.snapshot = make_snapshot([11, 12, 13])
+        # Сессия запущена с ?count=2: вопрос 13 отрезан
+        self.sequence = self.snapshot.sequence([11, 12])
+        self.store.seed(1, 11, True, {}, {})
+
+    def accept(self, question_index, participant_id=5):
+        return accept_answer(self.store, self.snapshot, 1, participant_id, question_index, True, 0, None, self.sequence)
+
+    def test_current_question_accepted_once(self):
+        self.assertIsNotNone(self.accept(0))
+        self.assertIsNone(self.accept(0))
+
+    def test_other_question_rejected(self):
+        self.assertIsNone(self.accept(1))
+        self.assertIsNone(self.accept(2))
+        # Отклоненный ответ не отмечает участника ответившим
+        self.assertIsNotNone(self.accept(0))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class RoomCommandTests(TransactionTestCase):
+    """Команды ведущего по WebSocket: закрывается тот вопрос, который видел ведущий, и только им"""
+
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        quiz = Quiz.objects.create(title='Quiz', description='', creator=self.host, code='ROOM1')
+        self.questions = []
+        for order in range(1, 4):
+            question = Question.objects.create(quiz=quiz, question_text=f'q{order}', order=order)
+            Answer.objects.create(question=question, answer_text='yes', is_correct=True)
+            Answer.objects.create(question=question, answer_text='no', is_correct=False)
+            self.questions.append(question.id)
+        self.session = QuizSession.objects.create(
+            quiz=quiz, session_code='ROOM1', current_question_id=self.questions[0], question_order=self.questions
+        )
+
+    def tearDown(self):
+        _states.clear()
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(QuizConsumer.as_asgi(), '/ws/quiz/ROOM1/')
+        communicator.scope['url_route'] = {'kwargs': {'session_code': 'ROOM1'}}
+        communicator.scope['user'] = user
+        return communicator
+
+    async def receive(self, communicator, message_type):
+        for _ in range(20):
+            frame = json.loads(await communicator.receive_from(timeout=3))
+            if frame['type'] == message_type:
+                return frame
+        self.fail(f'нет кадра {message_type}')
+
+    def test_next_question_api_is_host_only(self):
+        url = '/api/next-question/ROOM1/'
+        data = {'question_id': self.questions[0]}
+        self.assertEqual(self.client.post(url, data).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='player'))
+        self.assertEqual(self.client.post(url, data).status_code, 403)
+        self.client.force_login(self.host)
+        self.assertEqual(self.client.post(url, data).json(), {'success': True})
+        self.assertEqual(self.client.post(url, data).json(), {'success': False})
+
+    async def test_join_takes_user_from_connection(self):
+        player = await User.objects.acreate(username='player')
+        communicators = [self.communicator(player), self.communicator(AnonymousUser())]
+        for communicator, nickname in zip(communicators, ('player', 'guest')):
+            await communicator.connect()
+            await self.receive(communicator, 'session_info')
+            # user_id из сообщения клиента не учитывается
+            await communicator.send_json_to({'type': 'join_quiz', 'nickname': nickname, 'user_id': self.host.id})
+            await self.receive(communicator, 'room_delta')
+        users = {
+            participant.nickname: participant.user_id
+            async for participant in Participant.objects.filter(session=self.session)
+        }
+        self.assertEqual(users, {'player': player.id, 'guest': None})
+        for communicator in communicators:
+            await communicator.disconnect()
+        await _states['ROOM1'].drain()
+
+    async def test_double_next_question_closes_one_question(self):
+        host = self.communicator(self.host)
+        player = self.communicator(AnonymousUser())
+        for communicator in (host, player):
+            await communicator.connect()
+            await self.receive(communicator, 'session_info')
+        await host.send_json_to({'type': 'start_quiz'})
+        first = await self.receive(player, 'next_question')
+        self.assertEqual(first['question']['id'], self.questions[0])
+
+        # Игрок не управляет комнатой
+        await player.send_json_to({'type': 'next_question', 'question_id': self.questions[0]})
+        self.assertTrue(await player.receive_nothing(timeout=0.3))
+
+        await host.send_json_to({'type': 'next_question', 'question_id': self.questions[0]})
+        await host.send_json_to({'type': 'next_question', 'question_id': self.questions[0]})
+        second = await self.receive(player, 'next_question')
+        self.assertEqual(second['question']['id'], self.questions[1])
+        self.assertTrue(await player.receive_nothing(timeout=0.5))
+
+        await host.send_json_to({'type': 'end_quiz'})
+        await self.receive(player, 'quiz_ended')
+        for communicator in (host, player):
+            await communicator.disconnect()
+        await _states['ROOM1'].drain()
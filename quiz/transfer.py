@@ -0,0 +1,347 @@
+import csv
+import io
+import json
+import logging
+import os
+import zipfile
+from itertools import islice
+from urllib.parse import unquote
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.validators import URLValidator
+from django.db import transaction
+from django.db.models import Max
+from .catalog import invalidate_catalog
+from .media import build_variants
+from .models import Question, Answer
+from .snapshot import invalidate_quiz
+
+logger = logging.getLogger(__name__)
+
+# Сколько вопросов проверяется и записывается одним bulk_create
+IMPORT_CHUNK_SIZE = getattr(settings, 'QUIZ_IMPORT_CHUNK_SIZE', 500)
+IMPORT_MAX_ERRORS = getattr(settings, 'QUIZ_IMPORT_MAX_ERRORS', 20)
+# Больше ответов в CSV не читается: столбцы answer_1 ... answer_N
+CSV_MAX_ANSWERS = getattr(settings, 'QUIZ_CSV_MAX_ANSWERS', 8)
+CSV_COLUMNS = ['question', 'type', 'video_url', 'image'] + [
+    f'answer_{n}' for n in range(1, CSV_MAX_ANSWERS + 1)
+] + ['correct']
+
+QUESTION_TYPES = {value for value, _ in Question.QUESTION_TYPES}
+# Ссылка на видео попадает в <iframe src>: только http(s) и не длиннее поля модели
+VIDEO_URL_MAX_LENGTH = Question._meta.get_field('video_url').max_length
+validate_video_url = URLValidator(schemes=['http', 'https'])
+
+
+class QuizImportError(Exception):
+    """Ошибки файла импорта в виде списка строк 'строка N: описание'; ничего не записано"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def _jsonl_rows(text):
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None
+            continue
+        yield line_number, row
+
+
+def _csv_rows(text):
+    """Строки CSV в том же виде, что и JSON Lines: {'text', 'type', ..., 'answers': [{'text', 'correct'}]}"""
+    reader = csv.DictReader(text)
+    for row in reader:
+        correct = {item.strip() for item in (row.get('correct') or '').replace(',', ';').split(';') if item.strip()}
+        answers = []
+        for n in range(1, CSV_MAX_ANSWERS + 1):
+            answer = (row.get(f'answer_{n}') or '').strip()
+            if answer:
+                answers.append({'text': answer, 'correct': str(n) in correct})
+        yield reader.line_num, {
+            'text': row.get('question'),
+            'type': row.get('type') or 'text',
+            'video_url': row.get('video_url') or None,
+            'image': row.get('image') or None,
+            'answers': answers,
+        }
+
+
+def _valid_video_url(url):
+    if len(url) > VIDEO_URL_MAX_LENGTH:
+        return False
+    try:
+        validate_video_url(url)
+    except ValidationError:
+        return False
+    return True
+
+
+def _validate(line_number, row, images):
+    """Проверка одной строки; (данные вопроса, None) или (None, текст ошибки)"""
+    if not isinstance(row, dict):
+        return None, f'строка {line_number}: не удалось разобрать'
+    text = (row.get('text') or '').strip()
+    if not text:
+        return None, f'строка {line_number}: нет текста вопроса'
+    question_type = row.get('type') or 'text'
+    if question_type not in QUESTION_TYPES:
+        return None, f'строка {line_number}: неизвестный тип вопроса {question_type!r}'
+    answers = row.get('answers')
+    if not isinstance(answers, list) or len(answers) < 2:
+        return None, f'строка {line_number}: нужно не меньше двух ответов'
+    answers = [
+        {'text': str(answer.get('text') or '').strip()[:500], 'correct': bool(answer.get('correct'))}
+        for answer in answers if isinstance(answer, dict)
+    ]
+    if any(not answer['text'] for answer in answers) or len(answers) < 2:
+        return None, f'строка {line_number}: пустой ответ'
+    if not any(answer['correct'] for answer in answers):
+        return None, f'строка {line_number}: нет правильного ответа'
+    video_url = str(row.get('video_url') or '').strip() or None
+    if video_url is not None and not _valid_video_url(video_url):
+        return None, f'строка {line_number}: недопустимая ссылка на видео {video_url!r}'
+    image = row.get('image')
+    source = images.find(str(image)) if image else None
+    if image and source is None:
+        return None, f'строка {line_number}: изображение {image!r} не найдено ни в архиве, ни на сайте'
+    if source is not None and source[0] == 'archive' and not images.is_image(source[1]):
+        return None, f'строка {line_number}: файл {image!r} не является изображением или поврежден'
+    return {
+        'text': text,
+        'type': question_type,
+        'video_url': video_url,
+        'image': source,
+        'answers': answers,
+    }, None
+
+
+def _write_chunk(quiz, chunk, next_order, images):
+    """Вопросы и ответы пачки двумя bulk_create; возвращает вопросы с изображениями"""
+    questions = []
+    for offset, item in enumerate(chunk):
+        question = Question(
+            quiz=quiz,
+            question_text=item['text'],
+            question_type=item['type'],
+            video_url=item['video_url'],
+            order=next_order + offset,
+        )
+        if item['image']:
+            source, name = item['image']
+            if source == 'storage':
+                # Имя файла — хеш содержимого: изображение с сайта используется тем же файлом, без копии
+                question.image = name
+            else:
+                question.image = ContentFile(images.read(name), name=os.path.basename(name))
+                # Файл сохраняется сразу, а не при вставке строк: при откате импорта его нужно удалить
+                question.image.save(question.image.name, question.image.file, save=False)
+                images.saved.append(question.image.name)
+        questions.append(question)
+    Question.objects.bulk_create(questions)
+    if any(question.pk is None for question in questions):
+        # Бэкенд не возвращает ключи из bulk_create: они находятся по уникальному (quiz, order)
+        ids = dict(Question.objects.filter(
+            quiz=quiz, order__gte=next_order, order__lt=next_order + len(questions)
+        ).values_list('order', 'id'))
+        for question in questions:
+            question.pk = ids[question.order]
+    Answer.objects.bulk_create([
+        Answer(question_id=question.pk, answer_text=answer['text'], is_correct=answer['correct'])
+        for question, item in zip(questions, chunk)
+        for answer in item['answers']
+    ])
+    return [question for question in questions if question.image]
+
+
+def _import_rows(quiz, rows, images):
+    try:
+        with transaction.atomic():
+            return _insert_rows(quiz, rows, images)
+    except BaseException:
+        # Строки откатились, а файлы изображений уже в хранилище и остались бы ничьими
+        images.delete_saved()
+        raise
+
+
+def _insert_rows(quiz, rows, images):
+    next_order = (quiz.questions.aggregate(last=Max('order'))['last'] or 0) + 1
+    errors = []
+    with_images = []
+    imported = 0
+    chunk = []
+    for line_number, row in rows:
+        item, error = _validate(line_number, row, images)
+        if error:
+            errors.append(error)
+            if len(errors) >= IMPORT_MAX_ERRORS:
+                break
+            continue
+        chunk.append(item)
+        if len(chunk) >= IMPORT_CHUNK_SIZE and not errors:
+            with_images += _write_chunk(quiz, chunk, next_order, images)
+            next_order += len(chunk)
+            imported += len(chunk)
+            chunk = []
+    if errors:
+        # Откат всего, что уже записано: файл импортируется целиком или не импортируется
+        raise QuizImportError(errors)
+    if chunk:
+        with_images += _write_chunk(quiz, chunk, next_order, images)
+        imported += len(chunk)
+    return imported, with_images
+
+
+def import_questions(quiz, file, absolute_uri=None):
+    """Импорт вопросов из JSON Lines, CSV или ZIP (файл вопросов и изображения) одной транзакцией
+
+    absolute_uri — request.build_absolute_uri: изображения по ссылкам на медиафайлы этого сайта
+    (как в выгрузке export_jsonl/export_csv) берутся из хранилища, поэтому выгрузка импортируется обратно.
+    """
+    name = file.name.lower()
+    binary = file
+    archive = None
+    names = ()
+    if name.endswith('.zip'):
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile:
+            raise QuizImportError(['архив поврежден'])
+        names = archive.namelist()
+        inner = next((member for member in names if member.lower().endswith(('.jsonl', '.csv'))), None)
+        if inner is None:
+            raise QuizImportError(['в архиве нет файла .jsonl или .csv'])
+        name = inner.lower()
+        binary = archive.open(inner)
+        names = set(names) - {inner}
+    images = _Images(archive, names, absolute_uri(settings.MEDIA_URL) if absolute_uri else None)
+
+    text = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+    rows = _csv_rows(text) if name.endswith('.csv') else _jsonl_rows(text)
+    try:
+        imported, with_images = _import_rows(quiz, rows, images)
+    except UnicodeDecodeError:
+        raise QuizImportError(['файл должен быть в кодировке UTF-8'])
+    except csv.Error as error:
+        raise QuizImportError([f'ошибка CSV: {error}'])
+
+    # bulk_create не отправляет post_save: варианты изображений и сброс кэшей делаются здесь один раз
+    for question in with_images:
+        try:
+            variants = build_variants(question.image)
+        except Exception:
+            # Вопрос остается с оригиналом изображения, без уменьшенных копий
+            logger.exception('Не удалось построить варианты изображения %s', question.image.name)
+            continue
+        Question.objects.filter(id=question.pk).update(image_variants=variants)
+    invalidate_quiz(quiz.id)
+    invalidate_catalog()
+    return imported
+
+
+class _Images:
+    """Изображения импорта: файлы ZIP-архива и медиафайлы этого сайта по ссылкам из выгрузки"""
+
+    def __init__(self, archive=None, names=(), media_url=None):
+        self.archive = archive
+        self.names = names
+        self.media_url = media_url
+        self.storage = Question._meta.get_field('image').storage
+        # Файлы, сохраненные импортом в хранилище (удаляются, если импорт откатился)
+        self.saved = []
+
+    def find(self, image):
+        """Источник изображения ('archive' или 'storage', имя файла); None, если его нет"""
+        if image in self.names:
+            return 'archive', image
+        if self.media_url and image.startswith(self.media_url):
+            name = unquote(image[len(self.media_url):])
+            try:
+                if self.storage.exists(name):
+                    return 'storage', name
+            except SuspiciousFileOperation:
+                return None
+        return None
+
+    def read(self, name):
+        return self.archive.read(name)
+
+    def is_image(self, name):
+        """Файл архива открывается Pillow как изображение"""
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(self.read(name))) as image:
+                image.verify()
+        except Exception:
+            return False
+        return True
+
+    def delete_saved(self):
+        for name in self.saved:
+            self.storage.delete(name)
+        self.saved = []
+
+
+def _export_rows(quiz, absolute_uri):
+    questions = quiz.questions.order_by('order').prefetch_related('answers').iterator(chunk_size=IMPORT_CHUNK_SIZE)
+    for question in questions:
+        yield {
+            'text': question.question_text,
+            'type': question.question_type,
+            'video_url': question.video_url,
+            'image': absolute_uri(question.image.url) if question.image else None,
+            'answers': [
+                {'text': answer.answer_text, 'correct': answer.is_correct}
+                for answer in question.answers.all()
+            ],
+        }
+
+
+def export_jsonl(quiz, absolute_uri):
+    """Строки JSON Lines по одной на вопрос; вопросы читаются из БД пачками"""
+    for row in _export_rows(quiz, absolute_uri):
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def export_csv(quiz, absolute_uri):
+    """Строки CSV по одной на вопрос (не больше CSV_MAX_ANSWERS ответов)"""
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(CSV_COLUMNS)
+    for row in _export_rows(quiz, absolute_uri):
+        answers = row['answers'][:CSV_MAX_ANSWERS]
+        yield writer.writerow(
+            [row['text'], row['type'], row['video_url'] or '', row['image'] or '']
+            + [answer['text'] for answer in answers]
+            + [''] * (CSV_MAX_ANSWERS - len(answers))
+            + [';'.join(str(n) for n, answer in enumerate(answers, 1) if answer['correct'])]
+        )
+
+
+async def stream_async(lines, chunk_size=IMPORT_CHUNK_SIZE):
+    """Выгрузка для ASGI: строки синхронного генератора читаются пачками в потоке запросов к БД
+
+    Синхронный итератор StreamingHttpResponse под ASGI сначала собирается целиком в памяти.
+    """
+    lines = iter(lines)
+    try:
+        while True:
+            chunk = await sync_to_async(list)(islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield ''.join(chunk)
+    finally:
+        # Генератор закрывается в том же потоке, где открыт его курсор
+        await sync_to_async(lines.close)()
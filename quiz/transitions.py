@@ -0,0 +1,47 @@
+from channels.db import database_sync_to_async
+from django.utils import timezone
+from .answers import wait_for_answers
+from .models import QuizSession
+from .results import materialize_results
+
+# Все смены вопроса и завершения сессии (через планировщик scheduler.py) идут через advance:
+# следующий вопрос берется из порядка сессии за O(1), а смена делается сравнением с обменом в общем
+# хранилище, поэтому одновременные нажатия ведущего и повторные POST сдвигают вопрос ровно один раз.
+
+
+def advance(store, sequence, session_id, current_question_id):
+    """Переход от current_question_id к следующему вопросу или завершение сессии после последнего
+
+    Возвращает (id нового вопроса, False), (None, True), если этот вызов завершил сессию,
+    или None, если вопрос уже сменили или сессию уже завершили в другом месте.
+    """
+    question_id = sequence.next_id(current_question_id)
+    if question_id is None:
+        # Завершает только текущий последний вопрос; сменить его, кроме как завершением, нельзя,
+        # поэтому проверка и завершение не разделены гонкой
+        if store.get_current(session_id) != current_question_id:
+            return None
+        return (None, True) if store.finish(session_id) else None
+    if not store.advance(session_id, current_question_id, question_id):
+        return None
+    return question_id, False
+
+
+def persist_transition(session_id, question_id, ended, ended_at=None):
+    """Запись перехода в БД; завершенная сессия получает ended_at и итоги в одном месте"""
+    if not ended:
+        QuizSession.objects.filter(id=session_id).update(current_question_id=question_id)
+        return
+    QuizSession.objects.filter(id=session_id).update(is_active=False, ended_at=ended_at or timezone.now())
+    materialize_results(session_id)
+
+
+async def persist_end(store, sequence, session_id):
+    """Запись завершения сессии, когда ответы из буферов всех воркеров уже в БД
+
+    Итоги (SessionResult) вычисляются один раз, поэтому сначала дожидаемся ответов, принятых
+    другими воркерами: каждый из них записывает свой буфер, получив quiz_ended.
+    """
+    ended_at = timezone.now()
+    await wait_for_answers(store, session_id, sequence.question_ids)
+    await database_sync_to_async(persist_transition)(session_id, None, True, ended_at)
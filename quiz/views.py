@@ -1,33 +1,56 @@
 import random
 import string
+import time
+from asgiref.sync import async_to_sync
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
-from .models import Quiz, Question, Answer, QuizSession, Participant, UserAnswer
-from .forms import QuizForm, QuestionForm, AnswerFormSet, JoinQuizForm
+from .models import Quiz, Question, QuizSession, Participant
+from .forms import QuizForm, QuestionForm, AnswerFormSet, JoinQuizForm, QuestionImportForm
+from .analytics import send_answer
+from .answers import accept_answer, write_answers
+from .broadcast import send_room_delta
+from .catalog import CATALOG_CACHE_TIMEOUT, KeysetPage, catalog_version, popular_quizzes, recent_quizzes
+from .joining import NicknameTaken, join_session
+from .metrics import metrics as quiz_metrics
+from .results import materialize_results
+from .scheduler import Room, skip_question, time_left as get_time_left
+from .snapshot import build_question_order, get_snapshot
+from .state import get_loaded_state, seed_store
+from .stats import LeaderboardPage
+from .store import get_store
+from .transfer import QuizImportError, export_csv, export_jsonl, import_questions, stream_async
 
 
+# Запросы каталога ленивые: они выполняются только при промахе кэша фрагментов в шаблоне
+
 def home(request):
-    popular_quizzes = Quiz.objects.filter(is_active=True).order_by('-created_at')[:6]
-    recent_quizzes = Quiz.objects.filter(is_active=True).order_by('-created_at')[:6]
-    
     context = {
-        'popular_quizzes': popular_quizzes,
-        'recent_quizzes': recent_quizzes,
+        'popular_quizzes': popular_quizzes(6),
+        'recent_quizzes': recent_quizzes(6),
+        'catalog_version': catalog_version(),
+        'catalog_timeout': CATALOG_CACHE_TIMEOUT,
     }
     return render(request, 'quiz/home.html', context)
 
 
 def quiz_list(request):
-    quizzes = Quiz.objects.filter(is_active=True).order_by('-created_at')
-    return render(request, 'quiz/quiz_list.html', {'quizzes': quizzes})
+    cursor = request.GET.get('cursor', '')
+    page = KeysetPage(Quiz.objects.filter(is_active=True).with_stats(), cursor)
+    return render(request, 'quiz/quiz_list.html', {
+        'page': page,
+        'cursor': cursor,
+        'catalog_version': catalog_version(),
+        'catalog_timeout': CATALOG_CACHE_TIMEOUT,
+    })
 
 
 def quiz_detail(request, quiz_id):
-    quiz = get_object_or_404(Quiz, id=quiz_id, is_active=True)
+    quiz = get_object_or_404(Quiz.objects.with_stats(), id=quiz_id, is_active=True)
     return render(request, 'quiz/quiz_detail.html', {'quiz': quiz})
 
 
@@ -52,7 +75,7 @@ def add_questions(request, quiz_id):
     quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
     
     if request.method == 'POST':
-        question_form = QuestionForm(request.POST, request.FILES)
+        question_form = QuestionForm(request.POST, request.FILES, instance=Question(quiz=quiz))
         if question_form.is_valid():
             question = question_form.save(commit=False)
             question.quiz = quiz
@@ -72,10 +95,50 @@ def add_questions(request, quiz_id):
         'quiz': quiz,
         'question_form': question_form,
         'formset': formset,
+        'import_form': QuestionImportForm(),
         'questions': questions
     })
 
 
+@login_required
+def import_quiz(request, quiz_id):
+    """Загрузка банка вопросов файлом JSON Lines, CSV или ZIP с изображениями"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    
+    if request.method == 'POST':
+        form = QuestionImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                imported = import_questions(quiz, form.cleaned_data['file'], request.build_absolute_uri)
+            except QuizImportError as error:
+                messages.error(request, 'Импорт не выполнен: ' + '; '.join(error.errors))
+            else:
+                messages.success(request, f'Импортировано вопросов: {imported}')
+    
+    return redirect('quiz:add_questions', quiz_id=quiz.id)
+
+
+@login_required
+def export_quiz(request, quiz_id):
+    """Выгрузка вопросов викторины потоком, без сборки всего файла в памяти"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    
+    if request.GET.get('format') == 'csv':
+        lines = export_csv(quiz, request.build_absolute_uri)
+        content_type = 'text/csv; charset=utf-8'
+        extension = 'csv'
+    else:
+        lines = export_jsonl(quiz, request.build_absolute_uri)
+        content_type = 'application/x-ndjson; charset=utf-8'
+        extension = 'jsonl'
+    if isinstance(request, ASGIRequest):
+        # Под ASGI синхронный итератор собирается в памяти целиком, асинхронный отдается пачками
+        lines = stream_async(lines)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="quiz-{quiz.code}.{extension}"'
+    return response
+
+
 @login_required
 def start_quiz_session(request, quiz_id):
     quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
@@ -84,11 +147,23 @@ def start_quiz_session(request, quiz_id):
         messages.error(request, 'Добавьте вопросы в викторину!')
         return redirect('quiz:add_questions', quiz_id=quiz.id)
     
+    # ?shuffle=1 перемешивает вопросы, ?count=N оставляет первые N; порядок фиксируется на всю сессию
+    try:
+        count = max(0, int(request.GET.get('count') or 0))
+    except ValueError:
+        count = 0
+    question_order = build_question_order(
+        quiz.questions.order_by('order').values_list('id', flat=True),
+        shuffle=request.GET.get('shuffle') == '1',
+        count=count,
+    )
+    
     session_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-    session = QuizSession.objects.create(
+    QuizSession.objects.create(
         quiz=quiz,
         session_code=session_code,
-        current_question=quiz.questions.order_by('order').first()
+        current_question_id=question_order[0],
+        question_order=question_order
     )
     
     return redirect('quiz:quiz_session', session_code=session_code)
@@ -101,33 +176,31 @@ def join_quiz(request):
             session_code = form.cleaned_data['session_code']
             nickname = form.cleaned_data['nickname']
             
+            # Один запрос по индексу активных сессий и одна вставка участника
+            session_id = QuizSession.objects.filter(
+                session_code=session_code, is_active=True
+            ).values_list('id', flat=True).first()
+            if session_id is None:
+                messages.error(request, 'Сесію не знайдено або вона завершена!')
+                return render(request, 'quiz/join_quiz.html', {'form': form})
+            
             try:
-                # Отладочная информация
-                print(f"Поиск сессии с кодом: {session_code}")
-                all_sessions = QuizSession.objects.all()
-                print(f"Всего сессий в базе: {all_sessions.count()}")
-                for s in all_sessions:
-                    print(f"Сессия: {s.session_code}, активна: {s.is_active}")
-                
-                session = QuizSession.objects.get(session_code=session_code, is_active=True)
-                
-                if session.participants.filter(nickname=nickname).exists():
-                    messages.error(request, 'Нікнейм вже зайнятий!')
-                    return render(request, 'quiz/join_quiz.html', {'form': form})
-                
-                participant = Participant.objects.create(
-                    session=session,
-                    user=request.user if request.user.is_authenticated else None,
-                    nickname=nickname
+                participant = join_session(
+                    session_id, nickname, request.user.id if request.user.is_authenticated else None
                 )
-                
-                request.session['participant_id'] = participant.id
-                request.session['session_code'] = session_code
-                
-                return redirect('quiz:play_quiz', session_code=session_code)
-                
-            except QuizSession.DoesNotExist:
-                messages.error(request, 'Сесію не знайдено або вона завершена!')
+            except NicknameTaken:
+                messages.error(request, 'Нікнейм вже зайнятий!')
+                return render(request, 'quiz/join_quiz.html', {'form': form})
+            
+            # Новый участник рассылается группе комнаты: его добавят воркеры с сокетами комнаты
+            async_to_sync(send_room_delta)(Room(session_id, session_code, get_store()), added=[
+                {'id': participant.id, 'nickname': participant.nickname, 'score': 0, 'time': 0}
+            ])
+            
+            request.session['participant_id'] = participant.id
+            request.session['session_code'] = session_code
+            
+            return redirect('quiz:play_quiz', session_code=session_code)
     else:
         form = JoinQuizForm()
     
@@ -135,7 +208,7 @@ def join_quiz(request):
 
 
 def quiz_session(request, session_code):
-    session = get_object_or_404(QuizSession, session_code=session_code)
+    session = get_object_or_404(QuizSession.objects.select_related('quiz'), session_code=session_code)
     participants = session.participants.all()
     
     return render(request, 'quiz/quiz_session.html', {
@@ -145,7 +218,7 @@ def quiz_session(request, session_code):
 
 
 def play_quiz(request, session_code):
-    session = get_object_or_404(QuizSession, session_code=session_code, is_active=True)
+    session = get_object_or_404(QuizSession.objects.select_related('quiz'), session_code=session_code, is_active=True)
     
     participant_id = request.session.get('participant_id')
     if not participant_id:
@@ -156,74 +229,124 @@ def play_quiz(request, session_code):
     except Participant.DoesNotExist:
         return redirect('quiz:join_quiz')
     
+    snapshot = get_snapshot(session.quiz_id)
+    sequence = snapshot.sequence(session.question_order)
+    # Текущий вопрос, ответившие и счета общие с QuizConsumer и другими воркерами
+    store = seed_store(session.id, session.current_question_id, session.is_active)
+    
     if request.method == 'POST':
+        received_at = time.time()
         question_id = request.POST.get('question_id')
         answer_id = request.POST.get('answer_id')
         
         if question_id and answer_id:
-            question = get_object_or_404(Question, id=question_id)
-            answer = get_object_or_404(Answer, id=answer_id)
+            try:
+                question_index = snapshot.index_of[int(question_id)]
+                answer_question_index, is_correct = snapshot.answer_index[int(answer_id)]
+            except (KeyError, ValueError):
+                raise Http404
+            if answer_question_index != question_index:
+                raise Http404
+            question = snapshot.questions[question_index]
+            # Открытие и дедлайн вопроса общие для всех воркеров и хранятся в общем хранилище
+            timing = store.get_timing(session.id)
             
-            if not UserAnswer.objects.filter(participant=participant, question=question).exists():
-                user_answer = UserAnswer.objects.create(
-                    participant=participant,
-                    question=question,
-                    answer=answer,
-                    is_correct=answer.is_correct
-                )
+            accepted = accept_answer(
+                store, snapshot, session.id, participant.id, question_index, is_correct, received_at, timing, sequence
+            )
+            if accepted is not None:
+                participant.score = accepted['score']
+                write_answers([(
+                    participant.id, question['id'], int(answer_id), is_correct,
+                    accepted['points'], accepted['response_ms'], timezone.now()
+                )])
                 
-                if answer.is_correct:
-                    participant.score += 1
-                    participant.save()
+                # Синхронный view не трогает состояние комнаты в памяти: его фоновые задачи переживут
+                # async_to_sync. Новый счет, смену вопроса и счетчики панели ведущего получают из группы
+                # воркеры с сокетами комнаты, в том числе этого процесса
+                room = Room(session.id, session_code, store, snapshot, sequence)
+                async_to_sync(send_room_delta)(room, scores=[
+                    {'id': participant.id, 'score': accepted['score'], 'time': accepted['time']}
+                ], answered=[participant.id])
+                position = sequence.position_of.get(question['id'])
+                if position is not None:
+                    async_to_sync(send_answer)(session_code, participant.id, position, question['id'], int(answer_id))
                 
-                # Переходим к следующему вопросу
-                next_question = session.quiz.questions.filter(order__gt=question.order).order_by('order').first()
-                if next_question:
-                    session.current_question = next_question
-                    session.save()
-                else:
-                    # Викторина завершена
-                    session.is_active = False
-                    session.save()
-                    return redirect('quiz:quiz_results', session_code=session_code)
+                # В комнате без таймера первый ответ закрывает вопрос, как и раньше; вопрос с дедлайном
+                # закрывают только дедлайн и ведущий. Смена идет через планировщик и рассылается комнате
+                if timing is None or timing[2] is None:
+                    async_to_sync(skip_question)(room, question['id'])
     
-    current_question = session.current_question
-    if not current_question:
+    current_question = snapshot.question(store.get_current(session.id))
+    if not current_question or not store.is_active(session.id):
         return redirect('quiz:quiz_results', session_code=session_code)
     
-    answers = current_question.answers.all()
+    # Дедлайн общий для всех воркеров; вопрос, открытый без таймера, показывается с полным временем
+    time_left = get_time_left(store.get_timing(session.id), current_question['id'])
+    if time_left is None:
+        time_left = snapshot.time_per_question
     
     return render(request, 'quiz/play_quiz.html', {
         'session': session,
         'participant': participant,
         'current_question': current_question,
-        'answers': answers
+        'answers': current_question['answers'],
+        'next_image': snapshot.prefetch(sequence.next_index(current_question['id'])),
+        'time_left': int(time_left)
     })
 
 
 def quiz_results(request, session_code):
-    session = get_object_or_404(QuizSession, session_code=session_code)
-    participants = session.participants.all().order_by('-score')
+    session = get_object_or_404(QuizSession.objects.select_related('quiz'), session_code=session_code)
+    questions = None
+    
+    state = get_loaded_state(session_code)
+    if not session.is_active:
+        # Завершенная сессия отдается из итогов, вычисленных один раз при завершении
+        result = materialize_results(session.id)
+        participants = result.ranking
+        question_count = result.question_count
+        questions = result.questions
+    elif state is not None:
+        # Сессия идет в этом процессе: порядок и счет берутся из рейтинга в памяти
+        usernames = dict(session.participants.filter(user__isnull=False).values_list('id', 'user__username'))
+        participants = [dict(participant, username=usernames.get(participant['id'])) for participant in state.ranking()]
+        question_count = len(state.sequence)
+    else:
+        participants = [
+            {
+                'id': participant['id'],
+                'nickname': participant['nickname'],
+                'username': participant['user__username'],
+                'score': participant['score'],
+                'rank': rank,
+            }
+            for rank, participant in enumerate(session.participants.order_by('-score', 'response_ms', 'id').values(
+                'id', 'nickname', 'score', 'user__username'
+            ), 1)
+        ]
+        question_count = len(get_snapshot(session.quiz_id).sequence(session.question_order))
     
     participant_id = request.session.get('participant_id')
-    current_participant = None
-    if participant_id:
-        try:
-            current_participant = Participant.objects.get(id=participant_id, session=session)
-        except Participant.DoesNotExist:
-            pass
+    current_participant = next((p for p in participants if p['id'] == participant_id), None)
     
     return render(request, 'quiz/quiz_results.html', {
         'session': session,
         'participants': participants,
-        'current_participant': current_participant
+        'current_participant': current_participant,
+        'question_count': question_count,
+        'questions': questions
     })
 
 
 @login_required
 def my_quizzes(request):
-    quizzes = Quiz.objects.filter(creator=request.user).order_by('-created_at')
-    return render(request, 'quiz/my_quizzes.html', {'quizzes': quizzes})
+    quizzes = Quiz.objects.filter(creator=request.user).with_stats().order_by('-created_at')
+    return render(request, 'quiz/my_quizzes.html', {
+        'quizzes': quizzes,
+        'catalog_version': catalog_version(),
+        'catalog_timeout': CATALOG_CACHE_TIMEOUT,
+    })
 
 
 @login_required
@@ -254,22 +377,44 @@ def delete_quiz(request, quiz_id):
     return render(request, 'quiz/delete_quiz.html', {'quiz': quiz})
 
 
-@csrf_exempt
 def next_question(request, session_code):
     if request.method == 'POST':
-        session = get_object_or_404(QuizSession, session_code=session_code)
-        current_question = session.current_question
-        
-        if current_question:
-            next_question = session.quiz.questions.filter(order__gt=current_question.order).first()
-            session.current_question = next_question
-            session.save()
-            
-            if not next_question:
-                session.is_active = False
-                session.ended_at = timezone.now()
-                session.save()
+        session = get_object_or_404(QuizSession.objects.select_related('quiz'), session_code=session_code)
+        # Вопросы переключает только создатель викторины, как и команды ведущего по WebSocket
+        if not request.user.is_authenticated or request.user.id != session.quiz.creator_id:
+            return JsonResponse({'success': False}, status=403)
+        # Клиент передает закрываемый вопрос: повторный запрос относится к уже закрытому и следующий не пропускает
+        try:
+            question_id = int(request.POST.get('question_id'))
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False})
+        store = seed_store(session.id, session.current_question_id, session.is_active)
+        snapshot = get_snapshot(session.quiz_id)
+        # Смена вопроса — сравнение с обменом от question_id: при одновременных запросах вопрос сдвигается
+        # один раз. Она идет через планировщик: комната получает новый вопрос, воркеры — его дедлайн
+        changed = async_to_sync(skip_question)(
+            Room(session.id, session_code, store, snapshot, snapshot.sequence(session.question_order)), question_id
+        )
         
-        return JsonResponse({'success': True})
+        return JsonResponse({'success': changed})
     
-    return JsonResponse({'success': False})
\ No newline at end of file
+    return JsonResponse({'success': False})
+
+
+def leaderboard(request):
+    """Общий рейтинг пользователей по всем сессиям страницами по курсору"""
+    cursor = request.GET.get('cursor', '')
+    page = LeaderboardPage(cursor)
+    return render(request, 'accounts/leaderboard.html', {
+        'page': page,
+        'profiles': page.object_list,
+        'cursor': cursor,
+    })
+
+
+def metrics(request):
+    """Счетчики процесса в формате Prometheus; при заданном QUIZ_METRICS_TOKEN нужен Bearer-токен"""
+    token = getattr(settings, 'QUIZ_METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=403)
+    return HttpResponse(quiz_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')